@@ -0,0 +1,92 @@
+# Run from ./node: python -m benchmarks.bench_mixer_queue
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from communication.mixing import Mixer
+from metrics.node_metrics import init_metrics, metrics, MetricField
+from utils.config_store import ConfigStore
+
+QUEUE_SIZES = [10000, 30000, 100000]
+
+
+async def noop():
+    pass
+
+
+def noop_metrics():
+    pass
+
+
+@dataclass
+class LegacyQueueObject:
+    send_message: Awaitable
+    update_metrics: Callable
+
+
+class LegacyMixer:
+    """Queue path of the mixer before the deque: list queue drained with pop(0), metrics closure per item."""
+
+    def __init__(self):
+        self._outbox = []
+        self._queue = []
+
+    async def queue_item(self, msg_coroutine, update_metrics):
+        queue_obj = LegacyQueueObject(
+            send_message=msg_coroutine,
+            update_metrics=lambda: (
+                update_metrics(),
+                self.__update_message_metric(False),
+            )
+        )
+        self._queue.append(queue_obj)
+        metrics().set(MetricField.QUEUED_PACKAGES, len(self._queue))
+
+    def next_item(self):
+        if not self._outbox:
+            for _ in range(ConfigStore.mix_outbox_size):
+                if self._queue:
+                    self._outbox.append(self._queue.pop(0))
+        return self._outbox.pop()
+
+    def __update_message_metric(self, sending_covers):
+        metrics().set(MetricField.SENDING_MESSAGES, 0 if sending_covers else 1)
+
+
+async def legacy_run(n_items):
+    mixer = LegacyMixer()
+    start = time.perf_counter()
+    for _ in range(n_items):
+        await mixer.queue_item(noop, noop_metrics)
+    enqueued = time.perf_counter()
+    for _ in range(n_items):
+        mixer.next_item()
+    return enqueued - start, time.perf_counter() - enqueued
+
+
+async def mixer_run(n_items):
+    mixer = Mixer(cover_generator=None)
+    start = time.perf_counter()
+    for _ in range(n_items):
+        await mixer.queue_item(noop, noop_metrics)
+    enqueued = time.perf_counter()
+    lane = mixer._shared
+    for _ in range(n_items):
+        lane._next_item()
+    return enqueued - start, time.perf_counter() - enqueued
+
+
+def main():
+    init_metrics(controller_url="", host_name="bench")
+    ConfigStore.mix_enabled = True
+    ConfigStore.mix_shuffle = False  # isolate queue cost from the Fisher-Yates shuffle
+    print(f"{'queued':>8} {'impl':<8} {'enqueue ns/op':>14} {'dequeue ns/op':>14}")
+    for n_items in QUEUE_SIZES:
+        for name, (enqueue, dequeue) in (("list", asyncio.run(legacy_run(n_items))),
+                                         ("deque", asyncio.run(mixer_run(n_items)))):
+            print(f"{n_items:>8} {name:<8} {enqueue / n_items * 1e9:>14.0f} {dequeue / n_items * 1e9:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
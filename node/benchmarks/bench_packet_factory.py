@@ -0,0 +1,54 @@
+# Run from ./node: python -m benchmarks.bench_packet_factory
+# Workers load their keys from /config like the node does, so run where the PKI files exist.
+import asyncio
+import os
+import time
+from collections import deque
+
+from communication.sphinx.fixed_base_group import create_params
+from communication.sphinx.key_store import KeyStore
+from communication.sphinx.packet_factory import PacketFactory
+from communication.sphinx.sphinx_transport import SPHINX_PARAMS
+from communication.sphinx.sphinx_worker import forward_payload_capacity
+from metrics.node_metrics import init_metrics
+
+N_PACKETS = 400
+PATH = [1, 2, 3]
+REPLY_PATH = [3, 1, 0]
+WORKERS = [0, 1, 2, 4]
+WINDOWS = [1, 8]
+
+
+async def broadcast(factory, window, payload):
+    # same build window as SphinxTransport.send_to_peers
+    builds = deque()
+    start = time.perf_counter()
+    for _ in range(N_PACKETS):
+        builds.append(asyncio.ensure_future(factory.build(PATH, REPLY_PATH, payload)))
+        if len(builds) >= window:
+            await builds.popleft()
+    while builds:
+        await builds.popleft()
+    return N_PACKETS / (time.perf_counter() - start)
+
+
+async def run(n_workers):
+    params, key_store = create_params(SPHINX_PARAMS), KeyStore()
+    payload = b"x" * forward_payload_capacity(params, key_store, 0)  # a full model chunk
+    factory = PacketFactory(params, SPHINX_PARAMS, key_store, n_workers)
+    await asyncio.gather(*(factory.build(PATH, REPLY_PATH, payload) for _ in range(max(1, n_workers))))  # warm up
+    rates = [await broadcast(factory, window, payload) for window in WINDOWS]
+    factory.shutdown()
+    print(f"{n_workers:>8} " + " ".join(f"{rate:>13.0f}" for rate in rates))
+
+
+def main():
+    init_metrics(controller_url="", host_name="bench")
+    print(f"{os.cpu_count()} cores, {N_PACKETS} packets, {len(PATH)}-hop path and reply path")
+    print(f"{'workers':>8} " + " ".join(f"{f'window {window}/s':>13}" for window in WINDOWS))
+    for n_workers in WORKERS:
+        asyncio.run(run(n_workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# Run from ./node: python -m benchmarks.bench_path_selection
+import random
+import statistics
+import time
+
+from communication.sphinx.path_selector import PathSelector
+from communication.sphinx.sphinx_router import SphinxRouter
+
+N_PEERS = 30
+MAX_HOPS = 2
+N_PATHS = 100000
+SLOW_FRACTION = 0.1
+
+
+def link_latencies(rng):
+    # per-node link latency in seconds, a few overloaded relays are an order of magnitude slower
+    latencies = {peer_id: rng.lognormvariate(-5.3, 0.3) for peer_id in range(N_PEERS)}
+    for peer_id in rng.sample(range(1, N_PEERS), int(SLOW_FRACTION * N_PEERS)):
+        latencies[peer_id] *= 10
+    return latencies
+
+
+def legacy_path(start, target, peers):
+    intermediates = [nid for nid in peers if nid not in [start, target]]
+    return SphinxRouter.secure_random_path(intermediates, MAX_HOPS) + [target]
+
+
+def run(name, build_path, latencies, rng):
+    peers = list(range(N_PEERS))
+    rtts = []
+    elapsed = 0.0
+    for _ in range(N_PATHS):
+        target = rng.randrange(1, N_PEERS)
+        start = time.perf_counter()
+        path = build_path(0, target, peers)
+        reply_path = build_path(target, 0, peers)
+        elapsed += time.perf_counter() - start
+        rtts.append(sum(latencies[node] for node in path + reply_path))
+
+    quantiles = statistics.quantiles(rtts, n=100)
+    print(f"{name:<22} {elapsed / (2 * N_PATHS) * 1e6:>9.2f} us/path "
+          f"p50 {quantiles[49] * 1e3:>6.1f} ms  p95 {quantiles[94] * 1e3:>6.1f} ms  p99 {quantiles[98] * 1e3:>6.1f} ms")
+
+
+def main():
+    rng = random.Random(7)
+    latencies = link_latencies(rng)
+    uniform = PathSelector(MAX_HOPS)
+    weighted = PathSelector(MAX_HOPS, exclude_slowest=SLOW_FRACTION, link_score=latencies.get)
+
+    print(f"{N_PEERS} peers, {MAX_HOPS} max hops, {SLOW_FRACTION:.0%} slow relays")
+    run("legacy uniform", legacy_path, latencies, rng)
+    run("selector uniform",
+        lambda start, target, peers: uniform.hops(peers, (start, target), MAX_HOPS) + [target], latencies, rng)
+    run(f"selector excl. {SLOW_FRACTION:.0%}",
+        lambda start, target, peers: weighted.hops(peers, (start, target), MAX_HOPS) + [target], latencies, rng)
+
+
+if __name__ == "__main__":
+    main()
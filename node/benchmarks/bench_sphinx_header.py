@@ -0,0 +1,77 @@
+# Run from ./node: python -m benchmarks.bench_sphinx_header
+import os
+import pickle
+import tempfile
+import time
+
+from sphinxmix.SphinxClient import Nenc
+from sphinxmix.SphinxParams import SphinxParams
+
+from communication.sphinx.fixed_base_group import create_params
+from communication.sphinx.key_store import KeyStore
+from communication.sphinx.sphinx_transport import SPHINX_PARAMS
+from communication.sphinx.sphinx_worker import build_forward_packet, process_packet
+
+N_NODES = 10
+N_PACKETS = 300
+PATH = [3, 5, 7]
+REPLY_PATH = [6, 4, 0]
+PAYLOAD = b"x" * 256
+
+
+class LegacyKeys:
+    """Per-hop key lookup as before the path cache."""
+
+    def __init__(self, key_store):
+        self._key_store = key_store
+
+    def path_keys(self, path):
+        return list(map(Nenc, path)), [self._key_store.get_y(nid) for nid in path]
+
+    def get_x(self, node_id):
+        return self._key_store.get_x(node_id)
+
+
+def generate_keys(directory):
+    group = SphinxParams().group
+    priv_raw, pub_raw = {}, {}
+    for nid in range(N_NODES):
+        x = group.gensecret()
+        y = group.expon(group.g, [x])
+        priv_raw[nid] = (nid, x.binary(), y.export())
+        pub_raw[nid] = (nid, y.export())
+
+    priv_path, pub_path = os.path.join(directory, "pki_priv.pkl"), os.path.join(directory, "pki_pub.pkl")
+    with open(priv_path, "wb") as f:
+        pickle.dump(priv_raw, f)
+    with open(pub_path, "wb") as f:
+        pickle.dump(pub_raw, f)
+    return priv_path, pub_path
+
+
+def run(name, params, keys):
+    packets = []
+    start = time.perf_counter()
+    for _ in range(N_PACKETS):
+        packets.append(build_forward_packet(params, keys, PATH, REPLY_PATH, PAYLOAD)[0])
+    build_time = (time.perf_counter() - start) / N_PACKETS
+
+    start = time.perf_counter()
+    for data in packets:
+        process_packet(params, keys, PATH[0], data)
+    process_time = (time.perf_counter() - start) / N_PACKETS
+
+    print(f"{name:<24} build {build_time * 1e3:>6.3f} ms/packet  process {process_time * 1e3:>6.3f} ms/hop")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        key_store = KeyStore(*generate_keys(directory))
+
+    print(f"{len(PATH)}-hop path, {len(REPLY_PATH)}-hop reply path, {N_PACKETS} packets")
+    run("default group, per hop", SphinxParams(**SPHINX_PARAMS), LegacyKeys(key_store))
+    run("fixed-base, cached keys", create_params(SPHINX_PARAMS), key_store)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Run from ./node: python -m benchmarks.bench_tcp_reads
+import asyncio
+import time
+
+from communication.tcp_server import TcpServer
+from metrics.node_metrics import init_metrics
+
+PACKET_SIZE = 1253
+N_PACKETS = 200000
+
+
+async def run(mode):
+    done = asyncio.Event()
+    received = 0
+
+    async def message_handler(data, peer_id):
+        nonlocal received
+        received += 1
+        if received == N_PACKETS:
+            done.set()
+
+    async def batch_handler(packets, peer_id):
+        nonlocal received
+        received += len(packets)
+        if received == N_PACKETS:
+            done.set()
+
+    tcp_server = TcpServer(0, 0, {}, message_handler, PACKET_SIZE, batch_handler)
+
+    closed = asyncio.Event()
+
+    async def handle(reader, writer):
+        try:
+            if mode == "batched":
+                await tcp_server._read_batched(reader, 1)
+            else:
+                await tcp_server._read_single(reader, 1)
+        except asyncio.IncompleteReadError:
+            closed.set()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    packet = bytes(PACKET_SIZE)
+    start = time.perf_counter()
+    for i in range(N_PACKETS):
+        writer.write(packet)
+        if i % 1000 == 0:
+            await writer.drain()
+    await writer.drain()
+    await done.wait()
+    elapsed = time.perf_counter() - start
+
+    writer.close()
+    await writer.wait_closed()
+    await closed.wait()
+    server.close()
+    await server.wait_closed()
+    print(f"{mode:<8} {N_PACKETS / elapsed:>12.0f} packets/s")
+
+
+async def main():
+    init_metrics(controller_url="", host_name="bench")
+    await run("single")
+    await run("batched")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
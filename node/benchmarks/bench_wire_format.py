@@ -0,0 +1,56 @@
+# Run from ./node: python -m benchmarks.bench_wire_format
+import pickle
+import time
+import zlib
+
+import numpy as np
+
+from communication.packages import PackageHelper
+
+N_ITERATIONS = 20000
+CHUNK_BYTES = 512
+
+
+def legacy_serialize(msg) -> bytes:
+    return zlib.compress(pickle.dumps(msg))
+
+
+def legacy_deserialize(payload) -> dict:
+    msg = pickle.loads(zlib.decompress(payload))
+    chunk = msg["content"]
+    np.frombuffer(chunk["data"], dtype=np.float32, count=chunk["end"] - chunk["start"])
+    return msg
+
+
+def binary_deserialize(payload) -> dict:
+    return PackageHelper.deserialize_msg(payload)
+
+
+def bench(name, serialize, deserialize, msg):
+    payload = serialize(msg)
+
+    start = time.perf_counter()
+    for _ in range(N_ITERATIONS):
+        serialize(msg)
+    encode_us = (time.perf_counter() - start) / N_ITERATIONS * 1e6
+
+    start = time.perf_counter()
+    for _ in range(N_ITERATIONS):
+        deserialize(payload)
+    decode_us = (time.perf_counter() - start) / N_ITERATIONS * 1e6
+
+    print(f"{name:<12} {len(payload):>8} B/packet {encode_us:>10.2f} us encode {decode_us:>10.2f} us decode")
+
+
+def main():
+    n_floats = CHUNK_BYTES // 4
+    weights = np.random.default_rng(0).standard_normal(n_floats).astype(np.float32)
+    chunk = {"start": 104448, "end": 104448 + n_floats, "data": weights.tobytes()}
+    msg = PackageHelper.format_model_package(7, 816, chunk, 1002)
+
+    bench("pickle+zlib", legacy_serialize, legacy_deserialize, msg)
+    bench("binary", PackageHelper.serialize_msg, binary_deserialize, msg)
+
+
+if __name__ == "__main__":
+    main()
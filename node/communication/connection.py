@@ -1,52 +1,114 @@
 import asyncio
 import logging
+from collections import deque
 
 from metrics.node_metrics import metrics, MetricField
+from utils.config_store import ConfigStore
 from utils.exception_decorator import log_exceptions
 
 
 class Connection:
-    def __init__(self, host: str, port: int, reader, writer, peer_id: int):
+    """
+    Outbound connection with a send queue. Queued packets are coalesced into
+    batched writes by a writer task. Once the queued bytes pass the high watermark
+    the connection stops being writable until the writer drains them below the low
+    watermark; the mixer holds back packets for it meanwhile, and direct senders block.
+    A peer that does not drain a write within send_stall_timeout is closed.
+    """
+
+    def __init__(self, host: str, port: int, reader, writer, peer_id: int, on_closed=None):
         self._host = host
         self._port = port
         self._reader = reader
         self._writer = writer
         self._peer_id = peer_id
+        self._on_closed = on_closed
+        self._send_queue = deque()
+        self._buffered = 0
+        self._data_ready = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._writer_task = None
         if self._writer:
             self._is_active = True
+            self._writer_task = asyncio.create_task(self.__writer_loop())
             logging.info(f"Connected to peer {peer_id}")
         else:
             self._is_active = False
-            logging.warning(f"Connection to peer {peer_id} failed")
+            logging.debug(f"Connection to peer {peer_id} failed")
 
     @classmethod
-    async def create(cls, host: str, port: int, peer_id: int):
-        for attempt in range(3):
-            try:
-                reader, writer = await asyncio.open_connection(host, port)
-                return cls(host, port, reader, writer, peer_id)
-            except (ConnectionRefusedError, TimeoutError) as e:
-                await asyncio.sleep(2)
-        return cls(host, port, None, None, peer_id)
+    async def create(cls, host: str, port: int, peer_id: int, on_closed=None):
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port),
+                                                    timeout=ConfigStore.connect_timeout)
+            return cls(host, port, reader, writer, peer_id, on_closed)
+        except (ConnectionRefusedError, TimeoutError, asyncio.TimeoutError, OSError):
+            return cls(host, port, None, None, peer_id, on_closed)
 
     async def send(self, message: bytes):
         if not self.is_active:
             logging.debug(f"No connection to peer {self._peer_id}")
             return
 
-        try:
-            self._writer.write(message)
-        except (asyncio.TimeoutError, ConnectionResetError, BrokenPipeError, OSError) as e:
-            logging.error(f"Exception sending to peer {self._peer_id}. Marking as inactive.")
-            await self.close()
+        await self._writable.wait()
+        if not self.is_active:
             return
 
+        self._send_queue.append(message)
+        self._buffered += len(message)
+        if self._buffered >= ConfigStore.send_high_watermark:
+            self._writable.clear()
+        self._data_ready.set()
+
         metrics().increment(MetricField.TOTAL_MSG_SENT)
         metrics().increment(MetricField.TOTAL_MBYTES_SENT, len(message) / 1048576)
 
+    async def __writer_loop(self):
+        try:
+            while self._is_active:
+                await self._data_ready.wait()
+                self._data_ready.clear()
+                while self._send_queue:
+                    batch = []
+                    batch_bytes = 0
+                    while self._send_queue and batch_bytes < ConfigStore.send_batch_bytes:
+                        message = self._send_queue.popleft()
+                        batch.append(message)
+                        batch_bytes += len(message)
+
+                    self._writer.write(b"".join(batch))
+                    await asyncio.wait_for(self._writer.drain(), timeout=ConfigStore.send_stall_timeout)
+
+                    self._buffered -= batch_bytes
+                    if self._buffered <= ConfigStore.send_low_watermark:
+                        self._writable.set()
+                    metrics().set_labeled(MetricField.BUFFERED_BYTES, f"peer_{self._peer_id}", self._buffered)
+        except asyncio.TimeoutError:
+            logging.warning(f"Peer {self._peer_id} did not drain its send buffer for {ConfigStore.send_stall_timeout}s.")
+            await self.close()
+        except (ConnectionResetError, BrokenPipeError, OSError):
+            logging.error(f"Exception sending to peer {self._peer_id}. Marking as inactive.")
+            await self.close()
+
+    @property
+    def buffered_bytes(self):
+        return self._buffered
+
+    @property
+    def writable(self):
+        return self._writable.is_set()
+
     @log_exceptions
     async def close(self):
+        was_active = self._is_active
         self._is_active = False
+        self._writable.set()
+        if self._writer_task is not None and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+        self._writer_task = None
+        self._send_queue.clear()
+        self._buffered = 0
         if self._writer:
             try:
                 self._writer.close()
@@ -56,6 +118,8 @@ class Connection:
         self._writer = None
         self._reader = None
         logging.warning(f"Connection to peer {self._peer_id} closed.")
+        if was_active and self._on_closed is not None:
+            self._on_closed(self._peer_id)
 
     @property
     def is_active(self):
@@ -0,0 +1,60 @@
+import math
+import os
+import time
+
+import numpy as np
+from scipy.stats import truncnorm
+
+from metrics.node_metrics import metrics, MetricField
+
+
+class DelaySampler:
+    """
+    Mixing delays drawn from the OS CSPRNG in bulk. Each refill reads one block of
+    os.urandom, turns it into uniforms and transforms the whole buffer with numpy,
+    so a sample is a list pop instead of a syscall and a scipy call per packet.
+    """
+
+    DISTRIBUTIONS = ("truncated_normal", "exponential", "lognormal")
+
+    def __init__(self, distribution: str, mu: float, sigma: float, buffer_size: int = 4096,
+                 lower: float = 0.0, upper: float = 0.1):
+        if distribution not in DelaySampler.DISTRIBUTIONS:
+            raise ValueError(f"Unknown delay distribution: {distribution}")
+        self._distribution = distribution
+        self._mu = mu
+        self._sigma = sigma
+        self._lower = lower
+        self._upper = upper
+        self._buffer_size = buffer_size
+        self._buffer = []
+
+    def sample(self) -> float:
+        if not self._buffer:
+            self.__refill()
+        return self._buffer.pop()
+
+    @staticmethod
+    def secure_uniforms(n: int) -> np.ndarray:
+        """n uniforms in the open interval (0, 1) with 53 bits of CSPRNG entropy each."""
+        bits = np.frombuffer(os.urandom(8 * n), dtype=np.uint64) >> np.uint64(11)
+        return (bits.astype(np.float64) + 0.5) * 2.0 ** -53
+
+    def __refill(self):
+        start = time.perf_counter()
+        n = self._buffer_size
+        if self._distribution == "truncated_normal":
+            a = (self._lower - self._mu) / self._sigma
+            b = (self._upper - self._mu) / self._sigma
+            delays = truncnorm.ppf(DelaySampler.secure_uniforms(n), a, b, loc=self._mu, scale=self._sigma)
+        elif self._distribution == "exponential":
+            delays = -self._mu * np.log(DelaySampler.secure_uniforms(n))
+        else:
+            sigma_log = math.sqrt(math.log(1 + self._sigma ** 2 / self._mu ** 2))
+            mu_log = math.log(self._mu) - 0.5 * sigma_log ** 2
+            u1 = DelaySampler.secure_uniforms(n)
+            u2 = DelaySampler.secure_uniforms(n)
+            z = np.sqrt(-2.0 * np.log(u1)) * np.cos(2 * np.pi * u2)  # Box-Muller
+            delays = np.exp(mu_log + sigma_log * z)
+        self._buffer = delays.tolist()
+        metrics().set(MetricField.DELAY_SAMPLING_TIME, (time.perf_counter() - start) / n)
@@ -0,0 +1,68 @@
+import hashlib
+import math
+
+from metrics.node_metrics import metrics, MetricField
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float):
+        self.n_bits = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.n_bits + 7) // 8)
+        self.n_items = 0
+
+    def _positions(self, digest: bytes):
+        # double hashing over the two halves of one 128-bit digest
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def contains(self, digest: bytes) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+    def add(self, digest: bytes):
+        for pos in self._positions(digest):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.n_items += 1
+
+    @property
+    def n_bytes(self):
+        return len(self._bits)
+
+
+class DuplicateFilter:
+    """
+    Round-scoped duplicate detector built from two rotating Bloom filters.
+    Payloads are inserted into the current generation and checked against both;
+    the older generation is dropped when a new round starts or the current one is full.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float):
+        self._capacity = capacity
+        self._fp_rate = fp_rate
+        self._current = BloomFilter(capacity, fp_rate)
+        self._previous = BloomFilter(capacity, fp_rate)
+        self._round = None
+        self._checked = 0
+        self._hits = 0
+
+    def seen(self, payload: bytes, current_round: int) -> bool:
+        """Returns True if payload was seen before, otherwise records it."""
+        if self._round is None or current_round > self._round or self._current.n_items >= self._capacity:
+            self._round = current_round if self._round is None else max(self._round, current_round)
+            self.__rotate()
+
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        self._checked += 1
+        duplicate = self._current.contains(digest) or self._previous.contains(digest)
+        if duplicate:
+            self._hits += 1
+        else:
+            self._current.add(digest)
+        metrics().set(MetricField.DEDUP_HIT_RATE, self._hits / self._checked)
+        return duplicate
+
+    def __rotate(self):
+        self._previous = self._current
+        self._current = BloomFilter(self._capacity, self._fp_rate)
+        metrics().set(MetricField.DEDUP_BYTES, self._current.n_bytes + self._previous.n_bytes)
@@ -1,163 +1,391 @@
 import asyncio
 import logging
-import math
 import secrets
+import time
+from collections import deque
 from dataclasses import dataclass
-from typing import Awaitable, Callable
-
-from scipy.stats import truncnorm
+from enum import Enum
+from typing import Awaitable, Callable, Optional
 
+from communication.delay_sampler import DelaySampler
 from metrics.node_metrics import metrics, MetricField
 from utils.config_store import ConfigStore
 from utils.exception_decorator import log_exceptions
 from utils.logging_config import log_header
 
 
-@dataclass
+class TrafficClass(Enum):
+    ACK = "ack"  # SURB replies
+    RELAY = "relay"  # packets forwarded for other nodes
+    ORIGINATED = "originated"  # fragments sent by this node
+    RESEND = "resend"
+
+
+@dataclass(slots=True)
 class QueueObject:
-    send_message: Awaitable
-    update_metrics: Callable
+    send_message: Callable[[], Awaitable]
+    update_metrics: Optional[Callable]
+    cover: bool = False
+    traffic_class: TrafficClass = TrafficClass.ORIGINATED
+    enqueued: float = 0.0  # monotonic time the item entered the queue
+    next_hop: Optional[int] = None
+    on_drop: Optional[Callable] = None  # called instead of send_message when the next hop went down
 
 
-class Mixer:
-    def __init__(self, cover_generator):
-        self._outbox = []
-        self._queue = []
-        self._cover_generator = cover_generator
-        self._outbox_loop = None
-        self._next_send = None
-        self._running = False
+class AdaptiveRate:
+    """
+    Emission speedup over the cover baseline derived from the number of queued real packets.
+    The speedup rises at once to 1 + depth / target_depth (capped at max_speedup) and decays
+    geometrically back towards 1 once the backlog drains.
+    """
 
-    # inverse transform sampling of exponential distribution
-    @staticmethod
-    def secure_exponential(q):
-        u = int.from_bytes(secrets.token_bytes(7), "big") / 2 ** 56
-        if q == 0:
-            return 0.001
-        sleep_time = -math.log(1 - u) / (1 / q)
-        return min(sleep_time, 0.001)
+    def __init__(self, max_speedup: float, target_depth: int, decay: float):
+        self._max_speedup = max(1.0, max_speedup)
+        self._target_depth = max(1, target_depth)
+        self._decay = decay
+        self.speedup = 1.0
 
-    @staticmethod
-    def secure_uniform(mu=0, sigma=1):
-        u1 = (secrets.randbits(53) + 1) / (2 ** 53)  # avoid 0
-        u2 = (secrets.randbits(53) + 1) / (2 ** 53)
+    def update(self, queue_depth: int) -> float:
+        desired = min(self._max_speedup, 1.0 + queue_depth / self._target_depth)
+        if desired >= self.speedup:
+            self.speedup = desired
+        else:
+            self.speedup = max(desired, 1.0 + (self.speedup - 1.0) * self._decay)
+        return self.speedup
 
-        # Box-Muller transform
-        z0 = math.sqrt(-2.0 * math.log(u1)) * math.cos(2 * math.pi * u2)
-        return mu + sigma * z0
 
-    @staticmethod
-    def secure_lognormal(mean, std):
-        sigma_log = math.sqrt(math.log(1 + (std ** 2 / mean ** 2)))
-        mu_log = math.log(mean) - 0.5 * sigma_log ** 2
+class MixLane:
+    """
+    One mixing clock: a FIFO queue drained into shuffled outboxes of mix_outbox_size
+    items, padded with covers, emitted one per sampled delay. Lanes bound to a peer
+    report their metrics labeled with that peer.
 
-        # Secure normal sample via Box-Muller
-        u1 = (secrets.randbits(53) + 1) / (2 ** 53)
-        u2 = (secrets.randbits(53) + 1) / (2 ** 53)
-        z = math.sqrt(-2.0 * math.log(u1)) * math.cos(2 * math.pi * u2)
+    Packets whose next hop is not writable are held back per hop and their slots are
+    filled with covers, so one backpressured link neither blocks the lane's clock nor
+    the traffic to other peers. They rejoin the front of their queues once the hop drains.
+    """
+
+    def __init__(self, cover_source: Callable[[], Awaitable[Optional[QueueObject]]], label: Optional[str] = None,
+                 writable: Optional[Callable[[Optional[int]], bool]] = None):
+        self._label = label
+        self._cover_source = cover_source
+        self._writable = writable or (lambda next_hop: True)
+        self._deferred = {}  # next hop -> packets held back while it is backpressured
+        self._n_deferred = 0
+        self._outbox = []  # small shuffled batch, consumed from the end
+        self._queues = {traffic_class: deque() for traffic_class in TrafficClass}
+        self._weights = dict(zip(TrafficClass, ConfigStore.mix_class_weights))
+        self._credit = {traffic_class: 0 for traffic_class in TrafficClass}
+        self._depth = 0
+        self._cover_item = QueueObject(send_message=None, update_metrics=None, cover=True)  # cover slot placeholder
+        self._task = None
+        self._next_send = None
+        self._running = False
+        self._utilization = 0.0
+        self._delay_sampler = DelaySampler(ConfigStore.mix_delay_distribution, ConfigStore.mix_mu,
+                                           ConfigStore.mix_std, ConfigStore.delay_buffer_size)
+        self._rate = None
+        if ConfigStore.mix_adaptive:
+            self._rate = AdaptiveRate(ConfigStore.mix_max_speedup, ConfigStore.mix_target_queue,
+                                      ConfigStore.mix_rate_decay)
 
-        return math.exp(mu_log + sigma_log * z)
+    def start(self, on_sent: Callable[[QueueObject], None]):
+        self._running = True
+        self._task = asyncio.create_task(self.__outbox_loop(on_sent))
 
-    @staticmethod
-    def secure_truncated_normal(mu=0.005, sigma=0.002, a=0.0, b=0.1):
-        # Generate secure uniform random number in [0,1)
-        u = secrets.SystemRandom().random()
+    async def stop(self):
+        self._running = False
+        if self._task is None:
+            return
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            logging.warning(f"Outbox loop {self._label or ''} was forcibly cancelled.")
 
-        lower, upper = (a - mu) / sigma, (b - mu) / sigma
+    def append(self, queue_obj: QueueObject):
+        self._queues[queue_obj.traffic_class].append(queue_obj)
+        self._depth += 1
+        self.__set_metric(MetricField.QUEUED_PACKAGES, len(self))
 
-        return truncnorm.ppf(u, lower, upper, loc=mu, scale=sigma)
+    def drain(self):
+        """Removes and returns the real packets still queued, deferred or waiting in the outbox."""
+        items = [queue_obj for queue_obj in self._outbox if not queue_obj.cover]
+        self._outbox.clear()
+        for queue in self._queues.values():
+            items.extend(queue)
+            queue.clear()
+        for deferred in self._deferred.values():
+            items.extend(deferred)
+        self._deferred.clear()
+        self._depth = 0
+        self._n_deferred = 0
+        self.__set_metric(MetricField.QUEUED_PACKAGES, 0)
+        return items
 
     @log_exceptions
-    async def __outbox_loop(self):
+    async def __outbox_loop(self, on_sent):
         self._next_send = asyncio.get_event_loop().time()
+        pool_mode = ConfigStore.mix_mode == "pool"
+        # a pool flush sends a whole outbox, so by default it waits as long as stream mode takes for one
+        interval_scale = 1.0
+        if pool_mode:
+            interval_scale = (ConfigStore.mix_pool_interval or
+                              ConfigStore.mix_mu * ConfigStore.mix_outbox_size) / ConfigStore.mix_mu
         try:
             while self._running:
-                self.__update_outbox()
-
-                queue_obj = self._outbox.pop()
-                await queue_obj.send_message()
-                queue_obj.update_metrics()
+                if pool_mode:
+                    await self.__flush_outbox(on_sent)
+                else:
+                    queue_obj = self._next_item()
+                    if not queue_obj.cover and not self._writable(queue_obj.next_hop):
+                        # the hop filled up since the outbox was built, its slot carries a cover
+                        self.__defer(queue_obj)
+                        queue_obj = self._cover_item
+                    if queue_obj.cover:
+                        queue_obj = await self._cover_source()
+                    if queue_obj is not None:
+                        await self.__emit(queue_obj, on_sent)
 
                 now = asyncio.get_event_loop().time()
-                interval = Mixer.secure_truncated_normal(ConfigStore.mix_mu, ConfigStore.mix_std)
+                interval = self._delay_sampler.sample() * interval_scale
+                if self._rate is not None:
+                    interval /= self.__update_rate()
                 self._next_send += interval
                 sleep_time = max(0, self._next_send - now)
-                metrics().set(MetricField.OUT_INTERVAL, sleep_time)
+                self.__set_metric(MetricField.OUT_INTERVAL, sleep_time)
                 await asyncio.sleep(sleep_time)
         except Exception:
             logging.exception("Exception in __outbox_loop")
         finally:
-            logging.info("Outbox loop exited")
+            logging.info(f"Outbox loop {self._label or ''} exited")
+
+    async def __flush_outbox(self, on_sent):
+        # pool mix: the whole shuffled outbox leaves in one step, grouped by next hop so
+        # every connection gets its packets in one coalesced write
+        if self.outbox_is_empty():
+            self.__update_outbox()
+        slots = list(self._outbox)
+        self._outbox.clear()
+        # covers are resolved first, so they are grouped by their actual first hop as well
+        covers = iter(await asyncio.gather(*(self._cover_source() for queue_obj in slots if queue_obj.cover)))
+        by_hop = {}
+        for queue_obj in slots:
+            if queue_obj.cover:
+                queue_obj = next(covers)
+                if queue_obj is None:
+                    continue
+            by_hop.setdefault(queue_obj.next_hop, []).append(queue_obj)
+
+        async def send_group(group):
+            for queue_obj in group:
+                if not queue_obj.cover and not self._writable(queue_obj.next_hop):
+                    self.__defer(queue_obj)
+                    continue
+                await self.__emit(queue_obj, on_sent)
+
+        await asyncio.gather(*(send_group(group) for group in by_hop.values()))
+
+    async def __emit(self, queue_obj: QueueObject, on_sent):
+        await queue_obj.send_message()
+        on_sent(queue_obj)
+        self.__update_utilization(queue_obj.cover)
+
+    def __set_metric(self, field: MetricField, value):
+        if self._label is None:
+            metrics().set(field, value)
+        else:
+            metrics().set_labeled(field, self._label, value)
+
+    def __update_utilization(self, cover: bool):
+        # share of real packets among the recently emitted ones
+        self._utilization += 0.05 * ((0.0 if cover else 1.0) - self._utilization)
+        self.__set_metric(MetricField.LANE_UTILIZATION, self._utilization)
+
+    def __update_rate(self):
+        speedup = self._rate.update(self._depth)
+        self.__set_metric(MetricField.MIX_RATE, speedup / ConfigStore.mix_mu)
+        return speedup
+
+    def _next_item(self) -> QueueObject:
+        if self.outbox_is_empty():
+            self.__update_outbox()
+        return self._outbox.pop()
+
+    def __update_outbox(self):
+        if self._deferred:
+            self.__readmit_deferred()
+        n_real = 0
+        while n_real < ConfigStore.mix_outbox_size and self._depth > 0:
+            queue_obj = self._queues[self.__next_class()].popleft()
+            self._depth -= 1
+            if self._writable(queue_obj.next_hop):
+                self._outbox.append(queue_obj)
+                n_real += 1
+            else:
+                self.__defer(queue_obj)
+        self.__set_metric(MetricField.QUEUED_PACKAGES, len(self))
+        for _ in range(ConfigStore.mix_outbox_size - n_real):
+            self._outbox.append(self._cover_item)
+
+        if ConfigStore.mix_shuffle:
+            self.__shuffle_outbox()
+        else:
+            self._outbox.reverse()  # items are popped from the end, keep FIFO order
+
+    def __defer(self, queue_obj: QueueObject):
+        self._deferred.setdefault(queue_obj.next_hop, deque()).append(queue_obj)
+        self._n_deferred += 1
+
+    def __readmit_deferred(self):
+        for next_hop in [next_hop for next_hop in self._deferred if self._writable(next_hop)]:
+            deferred = self._deferred.pop(next_hop)
+            for queue_obj in reversed(deferred):
+                self._queues[queue_obj.traffic_class].appendleft(queue_obj)
+            self._depth += len(deferred)
+            self._n_deferred -= len(deferred)
+
+    def __next_class(self) -> TrafficClass:
+        # smooth weighted round robin over the classes with queued packets
+        backlogged = [traffic_class for traffic_class, queue in self._queues.items() if queue]
+        if len(backlogged) == 1:
+            return backlogged[0]
+        total = 0
+        for traffic_class in backlogged:
+            self._credit[traffic_class] += self._weights[traffic_class]
+            total += self._weights[traffic_class]
+        chosen = max(backlogged, key=self._credit.__getitem__)
+        self._credit[chosen] -= total
+        return chosen
+
+    def __shuffle_outbox(self):
+        n = len(self._outbox)
+        for i in range(n):
+            j = i + secrets.randbelow(n - i)
+            tmp = self._outbox[j]
+            self._outbox[j] = self._outbox[i]
+            self._outbox[i] = tmp
+
+    def outbox_is_empty(self):
+        return len(self._outbox) == 0
+
+    def queue_is_empty(self):
+        return self._depth == 0 and self._n_deferred == 0
+
+    def __len__(self):
+        return self._depth + self._n_deferred
+
+
+class Mixer:
+    """
+    Schedules outgoing packets through mixing lanes. By default a single lane carries
+    all traffic; with mix_lanes every next-hop peer gets its own lane and clock, so
+    egress scales with the number of links.
+    """
+
+    def __init__(self, cover_generator, writable: Optional[Callable[[Optional[int]], bool]] = None):
+        self._cover_generator = cover_generator
+        self._writable = writable
+        self._shared = MixLane(self.__next_cover, writable=writable)
+        self._lanes = {}
+        self._running = False
+        self._class_latency = {traffic_class: 0.0 for traffic_class in TrafficClass}
 
     async def start(self):
         if ConfigStore.mix_enabled:
             self._running = True
-            self._outbox_loop = asyncio.create_task(self.__outbox_loop())
+            if ConfigStore.mix_lanes:
+                for lane in self._lanes.values():
+                    lane.start(self.__complete)
+            else:
+                self._shared.start(self.__complete)
             log_header("Peer-Based Mixer")
             logging.info(f"Enabled: {ConfigStore.mix_enabled}")
             logging.info(f"Shuffle: {ConfigStore.mix_shuffle}")
+            logging.info(f"Mode: {ConfigStore.mix_mode}")
+            logging.info(f"Per-link lanes: {ConfigStore.mix_lanes}")
+            logging.info(f"Adaptive rate: {ConfigStore.mix_adaptive} (max speedup {ConfigStore.mix_max_speedup})")
             logging.info(f"N Cover Bytes: {ConfigStore.nr_cover_bytes}")
         else:
             logging.info(f"Mixer disabled")
 
     async def stop(self):
         self._running = False
-        try:
-            await self._outbox_loop
-        except asyncio.CancelledError:
-            logging.warning("Outbox loop was forcibly cancelled.")
+        await self._shared.stop()
+        for lane in self._lanes.values():
+            await lane.stop()
 
-    def __update_outbox(self):
-        if not self.outbox_is_empty():
+    def add_lane(self, peer_id: int):
+        if not ConfigStore.mix_lanes or peer_id in self._lanes:
             return
+        lane = MixLane(lambda: self.__next_cover(peer_id), label=f"peer_{peer_id}", writable=self._writable)
+        self._lanes[peer_id] = lane
+        if self._running:
+            lane.start(self.__complete)
 
-        for _ in range(ConfigStore.mix_outbox_size):
-            if not self.queue_is_empty():
-                self._outbox.append(self._queue.pop(0))
-            else:
-                self._outbox.append(self.__create_cover_item())
+    def remove_lane(self, peer_id: int):
+        # unregistered at once, so a peer that comes straight back up gets a fresh lane
+        lane = self._lanes.pop(peer_id, None)
+        if lane is not None:
+            asyncio.create_task(self.__retire_lane(peer_id, lane))
 
-        if ConfigStore.mix_shuffle:
-            self.__shuffle_outbox()
+    async def __retire_lane(self, peer_id: int, lane: MixLane):
+        await lane.stop()
+        dropped = lane.drain()
+        for queue_obj in dropped:
+            self.__drop(queue_obj)
+        if dropped:
+            logging.info(f"Dropped {len(dropped)} queued packets of lane to peer {peer_id}.")
 
-    def __shuffle_outbox(self):
-        n = len(self._outbox)
-        for i in range(n):
-            j = i + secrets.randbelow(n - i)
-            tmp = self._outbox[j]
-            self._outbox[j] = self._outbox[i]
-            self._outbox[i] = tmp
+    def __drop(self, queue_obj: QueueObject):
+        # the packet is onion-encrypted for its next hop and cannot take another link
+        if queue_obj.on_drop is not None:
+            queue_obj.on_drop()
+        metrics().increment(MetricField.LANE_DROPPED)
+
+    def __complete(self, queue_obj: QueueObject):
+        if queue_obj.update_metrics is not None:
+            queue_obj.update_metrics()
+        self.__update_message_metric(queue_obj.cover)
+        if not queue_obj.cover:
+            self.__update_latency_metric(queue_obj)
 
-    def __create_cover_item(self):
-        queue_obj = QueueObject(
-            send_message=self.__create_cover_task,
-            update_metrics=lambda: self.__update_message_metric(True),
-        )
-        return queue_obj
-
-    async def queue_item(self, msg_coroutine: Awaitable, update_metrics: Callable):
-        queue_obj = QueueObject(
-            send_message=msg_coroutine,
-            update_metrics=lambda: (
-                update_metrics(),
-                self.__update_message_metric(False),
-            )
-        )
+    def __update_latency_metric(self, queue_obj: QueueObject):
+        latency = time.monotonic() - queue_obj.enqueued
+        ewma = self._class_latency[queue_obj.traffic_class]
+        ewma = latency if ewma == 0.0 else ewma + 0.1 * (latency - ewma)
+        self._class_latency[queue_obj.traffic_class] = ewma
+        metrics().set_labeled(MetricField.QUEUE_LATENCY, queue_obj.traffic_class.value, ewma)
+
+    async def queue_item(self, msg_coroutine: Callable[[], Awaitable], update_metrics: Callable,
+                         next_hop: Optional[int] = None, traffic_class: TrafficClass = TrafficClass.ORIGINATED,
+                         on_drop: Optional[Callable] = None):
+        queue_obj = QueueObject(send_message=msg_coroutine, update_metrics=update_metrics,
+                                traffic_class=traffic_class, enqueued=time.monotonic(), next_hop=next_hop,
+                                on_drop=on_drop)
 
         if ConfigStore.mix_enabled:
-            self._queue.append(queue_obj)
-            metrics().set(MetricField.QUEUED_PACKAGES, len(self._queue))
+            lane = self.__lane_for(next_hop)
+            if lane is None:
+                self.__drop(queue_obj)
+            else:
+                lane.append(queue_obj)
         else:
             start = asyncio.get_event_loop().time()
             await queue_obj.send_message()
-            queue_obj.update_metrics()
+            self.__complete(queue_obj)
             metrics().set(MetricField.SENDING_TIME, asyncio.get_event_loop().time() - start)
 
+    def __lane_for(self, next_hop: Optional[int]) -> Optional[MixLane]:
+        if not ConfigStore.mix_lanes or next_hop is None:
+            return self._shared
+        # lanes exist only for active peers, a hop without one went down
+        return self._lanes.get(next_hop)
+
     def outbox_is_empty(self):
-        return len(self._outbox) == 0
+        return self._shared.outbox_is_empty() and all(lane.outbox_is_empty() for lane in self._lanes.values())
 
     def queue_is_empty(self):
-        return len(self._queue) == 0
+        return self._shared.queue_is_empty() and all(lane.queue_is_empty() for lane in self._lanes.values())
 
     def __update_message_metric(self, sending_covers):
         if sending_covers:
@@ -165,6 +393,13 @@ class Mixer:
         metrics().set(MetricField.SENDING_COVERS, 1 if sending_covers else 0)
         metrics().set(MetricField.SENDING_MESSAGES, 0 if sending_covers else 1)
 
-    async def __create_cover_task(self):
-        cover = await self._cover_generator()
-        await cover()
+    async def __next_cover(self, first_hop: Optional[int] = None) -> Optional[QueueObject]:
+        """The next cover as a queue item bound to its first hop, None if no cover can be written now."""
+        if first_hop is None:
+            cover = await self._cover_generator()
+        else:
+            cover = await self._cover_generator(first_hop)
+        if cover is None:
+            return None
+        next_hop, send_message = cover
+        return QueueObject(send_message=send_message, update_metrics=None, cover=True, next_hop=next_hop)
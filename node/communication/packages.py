@@ -1,14 +1,34 @@
-import pickle
-import zlib
+import struct
 from enum import Enum
 
+import numpy as np
+
 
 class PackageType(Enum):
     MODEL_PART = 1
     COVER = 2
+    MODEL_CODED = 3
+    READY = 4
 
 
 class PackageHelper:
+    """
+    Versioned fixed-layout wire format. Every package starts with
+    (version, type); model parts continue with
+    (round, part_idx, total_parts, start, end) followed by the raw little-endian float32 payload.
+    Erasure-coded model symbols continue with
+    (round, model_tag, n_floats, chunk_len, first_part, group_k, symbol_idx) followed by the symbol bytes.
+    Readiness announcements continue with (node_id, state).
+    """
+    WIRE_VERSION = 1
+    _PREFIX = struct.Struct("!BB")
+    _MODEL_HEADER = struct.Struct("!BBIIIII")
+    MODEL_HEADER_SIZE = _MODEL_HEADER.size
+    _CODED_HEADER = struct.Struct("!BBIIIIIHH")
+    CODED_HEADER_SIZE = _CODED_HEADER.size
+    _READY_HEADER = struct.Struct("!BBHB")
+    FLOAT_DTYPE = np.dtype("<f4")
+
     @staticmethod
     def format_model_package(current_round, chunk_idx, chunk, n_chunks):
         return {
@@ -19,6 +39,29 @@ class PackageHelper:
             "content": chunk
         }
 
+    @staticmethod
+    def format_coded_package(current_round, model_tag, n_floats, chunk_len, first_part, group_k, symbol_idx,
+                             symbol):
+        return {
+            "type": PackageType.MODEL_CODED,
+            "round": current_round,
+            "model_tag": model_tag,
+            "n_floats": n_floats,
+            "chunk_len": chunk_len,
+            "first_part": first_part,
+            "group_k": group_k,
+            "symbol_idx": symbol_idx,
+            "content": symbol
+        }
+
+    @staticmethod
+    def format_ready_package(node_id, state):
+        return {
+            "type": PackageType.READY,
+            "node_id": node_id,
+            "state": state
+        }
+
     @staticmethod
     def format_cover_package(content):
         return {
@@ -28,8 +71,91 @@ class PackageHelper:
 
     @staticmethod
     def serialize_msg(msg) -> bytes:
-        return zlib.compress(pickle.dumps(msg))
+        if msg["type"] == PackageType.MODEL_PART:
+            chunk = msg["content"]
+            header = PackageHelper._MODEL_HEADER.pack(
+                PackageHelper.WIRE_VERSION,
+                PackageType.MODEL_PART.value,
+                msg["round"],
+                msg["part_idx"],
+                msg["total_parts"],
+                chunk["start"],
+                chunk["end"]
+            )
+            return b"".join((header, chunk["data"]))
+
+        if msg["type"] == PackageType.MODEL_CODED:
+            header = PackageHelper._CODED_HEADER.pack(
+                PackageHelper.WIRE_VERSION,
+                PackageType.MODEL_CODED.value,
+                msg["round"],
+                msg["model_tag"],
+                msg["n_floats"],
+                msg["chunk_len"],
+                msg["first_part"],
+                msg["group_k"],
+                msg["symbol_idx"]
+            )
+            return b"".join((header, msg["content"]))
+
+        if msg["type"] == PackageType.READY:
+            return PackageHelper._READY_HEADER.pack(
+                PackageHelper.WIRE_VERSION,
+                PackageType.READY.value,
+                msg["node_id"],
+                msg["state"]
+            )
+
+        prefix = PackageHelper._PREFIX.pack(PackageHelper.WIRE_VERSION, msg["type"].value)
+        return b"".join((prefix, msg["content"]))
 
     @staticmethod
     def deserialize_msg(msg) -> dict:
-        return pickle.loads(zlib.decompress(msg))
+        view = memoryview(msg)
+        version, package_type = PackageHelper._PREFIX.unpack_from(view)
+        if version != PackageHelper.WIRE_VERSION:
+            raise ValueError(f"Unsupported wire format version {version}")
+
+        package_type = PackageType(package_type)
+        if package_type == PackageType.MODEL_PART:
+            _, _, current_round, part_idx, total_parts, start, end = PackageHelper._MODEL_HEADER.unpack_from(view)
+            data = np.frombuffer(view, dtype=PackageHelper.FLOAT_DTYPE, offset=PackageHelper.MODEL_HEADER_SIZE)
+            return {
+                "type": package_type,
+                "round": current_round,
+                "part_idx": part_idx,
+                "total_parts": total_parts,
+                "content": {
+                    "start": start,
+                    "end": end,
+                    "data": data
+                }
+            }
+
+        if package_type == PackageType.MODEL_CODED:
+            (_, _, current_round, model_tag, n_floats, chunk_len,
+             first_part, group_k, symbol_idx) = PackageHelper._CODED_HEADER.unpack_from(view)
+            return {
+                "type": package_type,
+                "round": current_round,
+                "model_tag": model_tag,
+                "n_floats": n_floats,
+                "chunk_len": chunk_len,
+                "first_part": first_part,
+                "group_k": group_k,
+                "symbol_idx": symbol_idx,
+                "content": np.frombuffer(view, dtype=np.uint8, offset=PackageHelper.CODED_HEADER_SIZE)
+            }
+
+        if package_type == PackageType.READY:
+            _, _, node_id, state = PackageHelper._READY_HEADER.unpack_from(view)
+            return {
+                "type": package_type,
+                "node_id": node_id,
+                "state": state
+            }
+
+        return {
+            "type": package_type,
+            "content": view[PackageHelper._PREFIX.size:]
+        }
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import math
+from enum import IntEnum
+
+
+class PeerState(IntEnum):
+    LISTENING = 1
+    CONNECTED = 2
+    MIXER_READY = 3
+    DONE = 4
+
+
+class PeerReadiness:
+    """Latest startup/shutdown state announced by each peer."""
+
+    def __init__(self, expected_peers):
+        self.expected_peers = set(expected_peers)
+        self._states = {}
+        self._changed = asyncio.Condition()
+
+    async def update(self, peer_id: int, state: PeerState):
+        async with self._changed:
+            self._states[peer_id] = state
+            self._changed.notify_all()
+        logging.debug(f"Peer {peer_id} announced {state.name}.")
+
+    def n_reached(self, state: PeerState):
+        return sum(1 for peer_id, peer_state in self._states.items()
+                   if peer_id in self.expected_peers and peer_state >= state)
+
+    def quorum(self, fraction: float):
+        return math.ceil(fraction * len(self.expected_peers))
+
+    async def wait_for(self, state: PeerState, fraction: float, timeout: float):
+        """Waits until a fraction of the expected peers reached state. Returns False on timeout."""
+        n_required = self.quorum(fraction)
+
+        async def reached():
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.n_reached(state) >= n_required)
+
+        try:
+            await asyncio.wait_for(reached(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logging.warning(f"Only {self.n_reached(state)}/{n_required} peers reached {state.name} after {timeout}s.")
+            return False
@@ -1,100 +1,226 @@
+import heapq
+import itertools
 import logging
+import sys
+import time
+from collections import defaultdict
 from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone
-from typing import List
-
-import numpy as np
+from typing import List, Optional
 
+from communication.sphinx.rto_estimator import RtoEstimator
 from metrics.node_metrics import metrics, MetricField
+from metrics.streaming_stats import StreamingStats
 from utils.config_store import ConfigStore
 from utils.exception_decorator import log_exceptions
 
 
-@dataclass
+@dataclass(slots=True)
 class Fragment:
     surb_id: bytes
     surb_key_tuble: tuple
     target_node: int
-    payload: bytes
-    timestamp: datetime
-    acked: bool
+    payload: bytes  # shared with all fragments carrying the same serialized chunk
+    timestamp: Optional[float]  # monotonic send time, None until the fragment leaves the mixer
     cover: bool
+    rto_key: tuple
+    group: Optional[tuple] = None  # (group_id, k) of an erasure-coded symbol
+
+
+@dataclass(slots=True)
+class SymbolGroup:
+    needed: int  # acks still missing before the receiver can decode the group
+    surb_ids: set
+    satisfied_at: Optional[float] = None
 
 
 class Cache:
+    """
+    SURB cache indexed by target node, with one min-heap of send timestamps per
+    RTO key for expiry and a live count of unacked fragments. Fragments are
+    evicted as soon as they are acked; heap entries of evicted or re-stamped
+    fragments are dropped lazily when popped. Payloads are reference counted,
+    so a chunk sent to every peer is stored once.
+
+    Erasure-coded symbols are tracked per group and target node. A group adds k
+    to the unacked count, not n, and once any k of its symbols are acked the rest
+    are evicted, so parity is never waited for and redundant symbols are not resent.
+    """
 
     def __init__(self):
         self.cache = {}
+        self._by_node = defaultdict(set)
+        self._send_heaps = defaultdict(list)
+        self._heap_seq = itertools.count()
+        self._payload_refs = {}
+        self._payload_bytes = 0
+        self._record_bytes = 0
+        self._unacked = 0
+        self._groups = {}
         self.out_counter = 0
         self.in_counter = 0
-        self.rtts = []
+        self.rtt_stats = StreamingStats()
+        self._quantiles_published = 0.0
+        self.rto_estimator = RtoEstimator(ConfigStore.resend_time, ConfigStore.rto_min, ConfigStore.resend_time)
 
     @log_exceptions
-    def new_fragment(self, surb_id: bytes, surb_key_tuple: tuple, target_node: int, payload: bytes, cover: bool):
-        now = datetime.now(timezone.utc)
-        fragment = Fragment(surb_id, surb_key_tuple, target_node, payload, now, False, cover)
+    def new_fragment(self, surb_id: bytes, surb_key_tuple: tuple, target_node: int, payload: bytes, cover: bool,
+                     n_hops: int = 0, group: Optional[tuple] = None):
+        if group is not None and not self.__join_group(surb_id, target_node, group):
+            return
+        payload = self.__acquire_payload(payload)
+        fragment = Fragment(surb_id, surb_key_tuple, target_node, payload, None, cover, (target_node, n_hops), group)
         self.cache[surb_id] = fragment
+        self._by_node[target_node].add(surb_id)
+        self._record_bytes += Cache.__record_size(fragment)
         self.out_counter += 1
-        if surb_id in self.cache and not self.cache[surb_id].cover:
-            metrics().increment(MetricField.UNACKED_MSG)
+        if not cover and group is None:
+            self._unacked += 1
+            metrics().set(MetricField.UNACKED_MSG, self._unacked)
+        self.__update_size_metric()
+
+    def __join_group(self, surb_id, target_node, group):
+        group_id, k = group
+        entry = self._groups.get((target_node, group_id))
+        if entry is None:
+            entry = SymbolGroup(k, set())
+            self._groups[(target_node, group_id)] = entry
+            self._unacked += k
+            metrics().set(MetricField.UNACKED_MSG, self._unacked)
+        if entry.needed == 0:
+            # a resend built while the group got decodable
+            return False
+        entry.surb_ids.add(surb_id)
+        return True
+
+    def __symbol_acked(self, fragment: Fragment):
+        entry = self._groups.get((fragment.target_node, fragment.group[0]))
+        if entry is None or entry.needed == 0:
+            return
+        entry.needed -= 1
+        self._unacked -= 1
+        metrics().set(MetricField.UNACKED_MSG, self._unacked)
+        if entry.needed == 0:
+            entry.satisfied_at = time.monotonic()
+            for surb_id in list(entry.surb_ids):
+                self.set_acked(surb_id)
 
     @log_exceptions
     def set_fragment_timestamp(self, surb_id):
-        self.cache[surb_id].timestamp = datetime.now(timezone.utc)
+        fragment = self.cache.get(surb_id)
+        if fragment is None:
+            return
+        fragment.timestamp = time.monotonic()
+        heapq.heappush(self._send_heaps[fragment.rto_key], (fragment.timestamp, next(self._heap_seq), surb_id))
 
     @log_exceptions
     def received_surb(self, surb_id):
-        self.set_acked(surb_id)
         entry = self.cache.get(surb_id)
-        if entry is None:
+        self.set_acked(surb_id)
+        if entry is not None and entry.group is not None:
+            self.__symbol_acked(entry)
+        if entry is None or entry.timestamp is None:
             return None
-        now = datetime.now(timezone.utc)
-        start = entry.timestamp
-        rtt = (now - start).total_seconds()
+        rtt = time.monotonic() - entry.timestamp
+        self.rto_estimator.observe(entry.rto_key, rtt)
         if ConfigStore.resend_time > rtt:
-            self.rtts.append(rtt)
+            self.rtt_stats.add(rtt)
             metrics().set(MetricField.LAST_RTT, rtt)
-        metrics().set(MetricField.AVG_RTT, np.mean(self.rtts))
+            self.__update_rtt_metrics()
         self.in_counter += 1
         return entry.surb_key_tuble
 
+    def __update_rtt_metrics(self):
+        metrics().set(MetricField.AVG_RTT, self.rtt_stats.mean)
+        metrics().set(MetricField.EWMA_RTT, self.rtt_stats.ewma)
+        metrics().set(MetricField.MIN_RTT, self.rtt_stats.min)
+        metrics().set(MetricField.MAX_RTT, self.rtt_stats.max)
+
+        # quantile queries walk the sketch buckets, so they are published at the metric push rate
+        now = time.monotonic()
+        if now - self._quantiles_published < ConfigStore.push_metric_interval:
+            return
+        self._quantiles_published = now
+        metrics().set(MetricField.P50_RTT, self.rtt_stats.quantile(0.5))
+        metrics().set(MetricField.P95_RTT, self.rtt_stats.quantile(0.95))
+        metrics().set(MetricField.P99_RTT, self.rtt_stats.quantile(0.99))
+
     @log_exceptions
     def delete_cache_for_node(self, target_node):
-        to_delete = [surb_id for surb_id, fragment in self.cache.items() if fragment.target_node == target_node]
+        to_delete = list(self._by_node.pop(target_node, ()))
         for surb_id in to_delete:
             self.set_acked(surb_id)
-            del self.cache[surb_id]
-        return len(to_delete)
-
-    @log_exceptions
-    def clear_acked_cache(self):
-        to_delete = [surb_id for surb_id, fragment in self.cache.items() if fragment.acked]
-        for surb_id in to_delete:
-            del self.cache[surb_id]
-        logging.debug(f"Cleared {len(to_delete)} acked fragments from cache.")
+        for key in [key for key in self._groups if key[0] == target_node]:
+            self._unacked -= self._groups.pop(key).needed
+        metrics().set(MetricField.UNACKED_MSG, self._unacked)
         return len(to_delete)
 
     def set_acked(self, surb_id: bytes):
-        if surb_id in self.cache:
-            self.cache[surb_id].acked = True
-        if surb_id in self.cache and not self.cache[surb_id].cover:
-            metrics().decrement(MetricField.UNACKED_MSG)
+        fragment = self.cache.pop(surb_id, None)
+        if fragment is None:
+            return
+        self._by_node[fragment.target_node].discard(surb_id)
+        self._record_bytes -= Cache.__record_size(fragment)
+        self.__release_payload(fragment.payload)
+        if fragment.group is not None:
+            entry = self._groups.get((fragment.target_node, fragment.group[0]))
+            if entry is not None:
+                entry.surb_ids.discard(surb_id)
+        elif not fragment.cover:
+            self._unacked -= 1
+            metrics().set(MetricField.UNACKED_MSG, self._unacked)
+        self.__update_size_metric()
+
+    def __acquire_payload(self, payload: bytes) -> bytes:
+        entry = self._payload_refs.get(payload)
+        if entry is None:
+            entry = [payload, 0]
+            self._payload_refs[payload] = entry
+            self._payload_bytes += len(payload)
+        entry[1] += 1
+        return entry[0]
+
+    def __release_payload(self, payload: bytes):
+        entry = self._payload_refs[payload]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._payload_refs[payload]
+            self._payload_bytes -= len(payload)
+
+    @staticmethod
+    def __record_size(fragment: Fragment):
+        return (sys.getsizeof(fragment) + sys.getsizeof(fragment.surb_id) +
+                sum(sys.getsizeof(key) for key in fragment.surb_key_tuble))
+
+    def __update_size_metric(self):
+        metrics().set(MetricField.CACHE_BYTES, self._payload_bytes + self._record_bytes)
 
     @log_exceptions
-    def get_older_than(self, seconds: float) -> List[Fragment]:
-        self.clear_acked_cache()
-
-        cutoff = datetime.now(timezone.utc) - timedelta(seconds=seconds)
-        to_resend = [fragment for fragment in self.cache.values() if
-                     fragment.timestamp < cutoff and not fragment.acked and not fragment.cover]
+    def get_expired(self) -> List[Fragment]:
+        now = time.monotonic()
+        to_resend = []
+        for rto_key, heap in self._send_heaps.items():
+            cutoff = now - self.rto_estimator.rto(rto_key)
+            while heap and heap[0][0] < cutoff:
+                timestamp, _, surb_id = heapq.heappop(heap)
+                fragment = self.cache.get(surb_id)
+                if fragment is not None and fragment.timestamp == timestamp:
+                    to_resend.append(fragment)
 
         for fragment in to_resend:
-            self.set_acked(fragment.surb_id)  # mark as acked to prevent resending
+            self.set_acked(fragment.surb_id)  # evict to prevent resending
+        for rto_key in {fragment.rto_key for fragment in to_resend}:
+            self.rto_estimator.timed_out(rto_key)
+        self.__drop_satisfied_groups(now)
 
         return to_resend
 
+    def __drop_satisfied_groups(self, now):
+        # kept for a while so resends built before the group got decodable are not cached again
+        for key in [key for key, entry in self._groups.items()
+                    if entry.satisfied_at is not None and now - entry.satisfied_at > ConfigStore.resend_time]:
+            del self._groups[key]
+
     @log_exceptions
     async def cache_all_acked(self):
-        unacked_fragments = sum(1 for fragment in self.cache.values() if not fragment.acked and not fragment.cover)
-        logging.info(f"Waiting for {unacked_fragments} SURBs.")
-        return not unacked_fragments
+        logging.info(f"Waiting for {self._unacked} SURBs.")
+        return not self._unacked
@@ -0,0 +1,148 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, List, Optional
+
+from metrics.node_metrics import metrics, MetricField
+from utils.exception_decorator import log_exceptions
+
+
+class CoverPool:
+    """
+    Prebuilt cover packets indexed by every peer on their path and by their first hop.
+    Covers traversing a peer that went down are evicted at once, so the pool only ever
+    hands out covers that can be delivered. A background worker tops the pool up with
+    one new cover per cover taken. Covers are (path, msg_bytes, timestamp_callback) tuples.
+    Covers whose first hop is backpressured stay in the pool until the link drains.
+    """
+
+    def __init__(self, builder: Callable[[Optional[int]], Awaitable], active_peers: Callable[[], List[int]],
+                 capacity: int, per_link: bool = False, writable: Optional[Callable[[int], bool]] = None):
+        self._builder = builder
+        self._active_peers = active_peers
+        self._writable = writable or (lambda peer_id: True)
+        self._capacity = capacity
+        self._per_link = per_link
+        self._covers = {}  # cover id -> (cover, built at), in build order
+        self._by_peer = defaultdict(set)
+        self._by_first_hop = defaultdict(deque)
+        self._ids = itertools.count()
+        self._wanted = asyncio.Event()
+        self._task = None
+        self._hits = 0
+        self._misses = 0
+
+    def start(self):
+        self._wanted.set()
+        self._task = asyncio.create_task(self.__refill_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def take(self, first_hop: Optional[int] = None):
+        """Returns the oldest cover leaving through first_hop (any writable hop if None)."""
+        cover_id = self.__oldest(first_hop)
+        if cover_id is None:
+            self._misses += 1
+            self._wanted.set()
+            self.__update_metrics()
+            return None
+
+        cover, built_at = self.__remove(cover_id)
+        self._hits += 1
+        self._wanted.set()
+        metrics().set(MetricField.COVER_POOL_STALENESS, time.monotonic() - built_at)
+        self.__update_metrics()
+        return cover
+
+    def refill(self):
+        self._wanted.set()
+
+    def evict_peer(self, peer_id: int):
+        stale = self._by_peer.pop(peer_id, set())
+        for cover_id in stale:
+            self.__remove(cover_id)
+        self._by_first_hop.pop(peer_id, None)
+        if stale:
+            metrics().increment(MetricField.COVER_POOL_EVICTED, len(stale))
+            logging.debug(f"Evicted {len(stale)} covers through inactive peer {peer_id}.")
+        self._wanted.set()
+        self.__update_metrics()
+
+    def __len__(self):
+        return len(self._covers)
+
+    def __oldest(self, first_hop):
+        if first_hop is None:
+            cover_id = next(iter(self._covers), None)
+            if cover_id is None:
+                return None
+            (path, _, _), _ = self._covers[cover_id]
+            if self._writable(path[0]):
+                return cover_id
+            # the oldest cover waits for its link, take the oldest one of a writable link instead
+            heads = [(ids[0], hop) for hop in list(self._by_first_hop)
+                     if self._writable(hop) and (ids := self.__live_ids(hop))]
+            if not heads:
+                return None
+            cover_id, first_hop = min(heads)
+        elif not self._writable(first_hop):
+            return None
+        ids = self.__live_ids(first_hop)
+        return ids.popleft() if ids else None
+
+    def __live_ids(self, first_hop):
+        ids = self._by_first_hop.get(first_hop)
+        # ids of covers taken through the shared path are dropped lazily
+        while ids and ids[0] not in self._covers:
+            ids.popleft()
+        return ids
+
+    def __add(self, cover):
+        cover_id = next(self._ids)
+        path = cover[0]
+        self._covers[cover_id] = (cover, time.monotonic())
+        for peer_id in path:
+            self._by_peer[peer_id].add(cover_id)
+        ids = self._by_first_hop[path[0]]
+        ids.append(cover_id)
+        if len(ids) > 2 * self._capacity:
+            self._by_first_hop[path[0]] = deque(i for i in ids if i in self._covers)
+
+    def __remove(self, cover_id):
+        cover, built_at = self._covers.pop(cover_id)
+        for peer_id in cover[0]:
+            self._by_peer[peer_id].discard(cover_id)
+        return cover, built_at
+
+    def __next_first_hop(self, active_peers):
+        if not self._per_link:
+            return None
+        # keep the links evenly stocked
+        return min(active_peers, key=lambda peer_id: len(self._by_first_hop.get(peer_id, ())))
+
+    @log_exceptions
+    async def __refill_loop(self):
+        while True:
+            await self._wanted.wait()
+            self._wanted.clear()
+            while len(self._covers) < self._capacity:
+                active_peers = self._active_peers()
+                if not active_peers:
+                    break
+                cover = await self._builder(self.__next_first_hop(active_peers))
+                if cover is None:
+                    break
+                if all(peer_id in active_peers for peer_id in cover[0]):
+                    self.__add(cover)
+            self.__update_metrics()
+
+    def __update_metrics(self):
+        metrics().set(MetricField.COVER_POOL_SIZE, len(self._covers))
+        total = self._hits + self._misses
+        if total:
+            metrics().set(MetricField.COVER_POOL_HIT_RATE, self._hits / total)
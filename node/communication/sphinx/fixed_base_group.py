@@ -0,0 +1,40 @@
+import logging
+
+from petlib.bindings import _C, _FFI
+from petlib.bn import get_ctx
+from petlib.ec import EcPt
+from sphinxmix.SphinxParams import SphinxParams, Group_ECC
+
+
+class FixedBaseGroup(Group_ECC):
+    """
+    Group_ECC whose generator multiplications go through the scalar-times-generator
+    slot of EC_POINT_mul, which uses the precomputed generator table of the curve.
+    petlib's `x * g` treats g as an arbitrary point and skips that table. Every
+    Sphinx header computes one such alpha per hop.
+    """
+
+    def __init__(self, gid=713):
+        super().__init__(gid)
+        ctx = get_ctx().bnctx
+        if not _C.EC_GROUP_have_precompute_mult(self.G.ecg):
+            _C.EC_GROUP_precompute_mult(self.G.ecg, ctx)
+
+    def expon_base(self, exp):
+        x = exp[0]
+        for f in exp[1:]:
+            x = x.mod_mul(f, self.G.order())
+        res = EcPt(self.G)
+        err = _C.EC_POINT_mul(self.G.ecg, res.pt, x.bn, _FFI.NULL, _FFI.NULL, get_ctx().bnctx)
+        if not err:
+            return x * self.g
+        return res
+
+
+def create_params(params_kwargs) -> SphinxParams:
+    try:
+        group = FixedBaseGroup()
+    except Exception as e:
+        logging.warning(f"Fixed-base group unavailable, using the default group: {e}")
+        group = None
+    return SphinxParams(group=group, **params_kwargs)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from communication.sphinx.sphinx_worker import init_worker, process_packet, process_batch_in_worker
+from metrics.node_metrics import metrics, MetricField
+from utils.exception_decorator import log_exceptions
+
+
+class InboundPipeline:
+    """
+    Batches raw packets from all connections into a process pool for Sphinx
+    header processing and decryption. Results are handed to the handler in
+    arrival order per connection. With n_workers == 0 packets are processed inline.
+    """
+
+    def __init__(self, node_id, params, params_kwargs, key_store, handler, n_workers, batch_size,
+                 max_pending_per_peer=1024):
+        self._node_id = node_id
+        self._params = params
+        self._key_store = key_store
+        self._handler = handler
+        self._batch_size = batch_size
+        self._max_pending_per_peer = max_pending_per_peer
+        self._executor = None
+        if n_workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(params_kwargs,)
+            )
+        self._in_flight = asyncio.Semaphore(max(1, n_workers) * 2)
+        self._pending = []
+        self._batch_ready = asyncio.Event()
+        self._peer_queues = {}
+        self._tasks = []
+        self._cpu_time = 0.0
+        self._n_processed = 0
+
+    def start(self):
+        if self._executor is not None:
+            self._tasks.append(asyncio.create_task(self.__batch_loop()))
+
+    async def submit(self, data: bytes, peer_id: int):
+        await self.submit_batch([data], peer_id)
+
+    @log_exceptions
+    async def submit_batch(self, packets, peer_id: int):
+        if self._executor is None:
+            for data in packets:
+                try:
+                    result = process_packet(self._params, self._key_store, self._node_id, bytes(data))
+                except Exception as e:
+                    result = e
+                await self._handler(result, peer_id)
+            return
+
+        queue = self.__peer_queue(peer_id)
+        for data in packets:
+            future = asyncio.get_running_loop().create_future()
+            await queue.put(future)
+            self._pending.append((data, future))
+            self._batch_ready.set()
+        metrics().set(MetricField.INBOUND_PENDING, len(self._pending))
+
+    def __peer_queue(self, peer_id):
+        if peer_id not in self._peer_queues:
+            queue = asyncio.Queue(maxsize=self._max_pending_per_peer)
+            self._peer_queues[peer_id] = queue
+            self._tasks.append(asyncio.create_task(self.__deliver_loop(peer_id, queue)))
+        return self._peer_queues[peer_id]
+
+    async def __batch_loop(self):
+        while True:
+            await self._batch_ready.wait()
+            self._batch_ready.clear()
+            while self._pending:
+                await self._in_flight.acquire()
+                batch = self._pending[:self._batch_size]
+                del self._pending[:self._batch_size]
+                asyncio.create_task(self.__process_batch(batch))
+
+    async def __process_batch(self, batch):
+        try:
+            loop = asyncio.get_running_loop()
+            results, cpu_time = await loop.run_in_executor(
+                self._executor, process_batch_in_worker, self._node_id, [bytes(data) for data, _ in batch]
+            )
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            self.__update_metrics(len(batch), cpu_time)
+        except Exception as e:
+            logging.warning(f"Inbound batch of {len(batch)} packets failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(e)
+        finally:
+            self._in_flight.release()
+
+    async def __deliver_loop(self, peer_id, queue):
+        while True:
+            future = await queue.get()
+            result = await future
+            await self._handler(result, peer_id)
+
+    def __update_metrics(self, batch_size, cpu_time):
+        self._n_processed += batch_size
+        self._cpu_time += cpu_time
+        metrics().set(MetricField.INBOUND_BATCH_SIZE, batch_size)
+        metrics().set(MetricField.INBOUND_PENDING, len(self._pending))
+        if self._cpu_time > 0:
+            metrics().set(MetricField.INBOUND_PACKETS_PER_CORE_SECOND, self._n_processed / self._cpu_time)
+
+    def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logging.info("Inbound pipeline stopped.")
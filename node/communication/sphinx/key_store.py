@@ -1,31 +1,39 @@
 import pickle
+from collections import OrderedDict
 
 from petlib.bn import Bn
 from petlib.ec import EcGroup, EcPt
 from sphinxmix.SphinxClient import (
-    pki_entry
+    pki_entry, Nenc
 )
 
 from utils.exception_decorator import log_exceptions
 
 
 class KeyStore:
+    """
+    Node keys loaded from the PKI files. The encoded route and public key of every node
+    are kept together, and the (routing, keys) lists of recently used paths are cached,
+    so building a header does not re-encode the same nodes for every packet.
+    """
 
-    def __init__(self):
+    def __init__(self, priv_path="/config/pki_priv.pkl", pub_path="/config/pki_pub.pkl", max_cached_paths=4096):
+        self._priv_path = priv_path
+        self._pub_path = pub_path
         self._pkiPriv = dict()
         self._pkiPub = dict()
+        self._routes = dict()
+        self._paths = OrderedDict()
+        self._max_cached_paths = max_cached_paths
         self.load_keys()
 
     @log_exceptions
     def load_keys(self):
 
-        priv_path = "/config/pki_priv.pkl"
-        pub_path = "/config/pki_pub.pkl"
-
-        with open(priv_path, "rb") as f:
+        with open(self._priv_path, "rb") as f:
             priv_raw = pickle.load(f)
 
-        with open(pub_path, "rb") as f:
+        with open(self._pub_path, "rb") as f:
             pub_raw = pickle.load(f)
 
         ec = EcGroup()
@@ -41,6 +49,9 @@ class KeyStore:
             y = EcPt.from_binary(y_bytes, ec)
             self._pkiPub[nid] = pki_entry(nid, None, y)
 
+        self._routes = {nid: Nenc(nid) for nid in self._pkiPub}
+        self._paths.clear()
+
     @log_exceptions
     def get_x(self, node_id):
         if node_id in self._pkiPriv:
@@ -50,5 +61,19 @@ class KeyStore:
     @log_exceptions
     def get_y(self, node_id):
         if node_id in self._pkiPub:
-            return self._pkiPriv[node_id].y
+            return self._pkiPub[node_id].y
         return None
+
+    def path_keys(self, path):
+        """Returns the (routing, keys) lists of path for create_header, cached per path."""
+        key = tuple(path)
+        entry = self._paths.get(key)
+        if entry is not None:
+            self._paths.move_to_end(key)
+            return entry
+
+        entry = ([self._routes.get(nid) or Nenc(nid) for nid in key], [self.get_y(nid) for nid in key])
+        self._paths[key] = entry
+        if len(self._paths) > self._max_cached_paths:
+            self._paths.popitem(last=False)
+        return entry
@@ -0,0 +1,82 @@
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from metrics.node_metrics import metrics, MetricField
+
+
+@dataclass(slots=True)
+class Probe:
+    peers: tuple  # every other node on the loop, forward and reply path
+    rto_key: tuple
+    n_links: int
+    created: float
+    sent: Optional[float] = None  # monotonic send time, None while the cover waits in the pool
+
+
+class LinkStats:
+    """
+    Per-peer link latency and loss learned from loop covers. A loop cover returns to
+    its sender as a SURB reply like any fragment, so each one yields a timed sample of
+    the whole loop; the per-link share of that time and the loss outcome are folded into
+    an EWMA for every peer the loop traversed.
+    """
+
+    def __init__(self, node_id: int, alpha: float = 0.1):
+        self._node_id = node_id
+        self._alpha = alpha
+        self._probes = {}
+        self._latency = {}
+        self._loss = {}
+
+    def new_probe(self, surb_id: bytes, path, reply_path):
+        peers = tuple({peer_id for peer_id in path + reply_path if peer_id != self._node_id})
+        rto_key = (path[-1], len(path) + len(reply_path))
+        self._probes[surb_id] = Probe(peers, rto_key, len(path) + len(reply_path), time.monotonic())
+
+    def sent(self, surb_id: bytes):
+        probe = self._probes.get(surb_id)
+        if probe is not None:
+            probe.sent = time.monotonic()
+
+    def received(self, surb_id: bytes):
+        """Returns (rto_key, rtt) if surb_id belongs to a probe, otherwise None."""
+        probe = self._probes.pop(surb_id, None)
+        if probe is None or probe.sent is None:
+            return None
+        rtt = time.monotonic() - probe.sent
+        for peer_id in probe.peers:
+            self.__update(peer_id, rtt / probe.n_links, lost=False)
+        return probe.rto_key, rtt
+
+    def expire(self, timeout: float, unsent_timeout: float):
+        """Counts probes without reply after timeout as lost and forgets covers that were never sent."""
+        now = time.monotonic()
+        for surb_id, probe in list(self._probes.items()):
+            if probe.sent is not None and now - probe.sent > timeout:
+                del self._probes[surb_id]
+                for peer_id in probe.peers:
+                    self.__update(peer_id, None, lost=True)
+            elif probe.sent is None and now - probe.created > unsent_timeout:
+                del self._probes[surb_id]
+
+    def latency(self, peer_id: int) -> Optional[float]:
+        return self._latency.get(peer_id)
+
+    def loss(self, peer_id: int) -> float:
+        return self._loss.get(peer_id, 0.0)
+
+    def matrix(self):
+        """Current {peer_id: (link latency, loss rate)} estimates."""
+        return {peer_id: (self._latency.get(peer_id), self.loss(peer_id)) for peer_id in self._loss}
+
+    def __update(self, peer_id, link_latency, lost: bool):
+        loss = self._loss.get(peer_id)
+        sample = 1.0 if lost else 0.0
+        self._loss[peer_id] = sample if loss is None else loss + self._alpha * (sample - loss)
+        metrics().set_labeled(MetricField.LINK_LOSS, f"peer_{peer_id}", self._loss[peer_id])
+        if lost:
+            return
+        latency = self._latency.get(peer_id)
+        self._latency[peer_id] = link_latency if latency is None else latency + self._alpha * (link_latency - latency)
+        metrics().set_labeled(MetricField.LINK_LATENCY, f"peer_{peer_id}", self._latency[peer_id])
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from communication.sphinx.sphinx_worker import (
+    init_worker, build_forward_packet, build_in_worker,
+    build_surb, build_surb_in_worker, build_forward_with_surb, build_with_surb_in_worker
+)
+from metrics.node_metrics import metrics, MetricField
+from utils.exception_decorator import log_exceptions
+
+# builds finished within this many seconds make up FACTORY_PACKETS_PER_SECOND
+_RATE_WINDOW = 5.0
+
+
+class PacketFactory:
+    """
+    Builds Sphinx forward packets together with their SURB in a process pool,
+    so the EC work of a broadcast does not block the event loop.
+    With n_workers == 0 packets are built inline.
+    """
+
+    def __init__(self, params, params_kwargs, key_store, n_workers):
+        self._params = params
+        self._key_store = key_store
+        self._n_workers = n_workers
+        self._executor = None
+        if n_workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(params_kwargs,)
+            )
+        self._n_built = 0
+        self._cpu_time = 0.0
+        self._recent_builds = deque()
+
+    @log_exceptions
+    async def build(self, path, reply_path, payload):
+        if self._executor is None:
+            result = build_forward_packet(self._params, self._key_store, path, reply_path, payload)
+        else:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, build_in_worker, path, reply_path, payload)
+
+        msg_bytes, surbid, surbkeytuple, cpu_time = result
+        self.__update_metrics(cpu_time)
+        return msg_bytes, surbid, surbkeytuple
+
+    @log_exceptions
+    async def build_surb(self, reply_path):
+        """Returns (surbid, surbkeytuple, nym_bytes) of a SURB for later use with build_with_surb."""
+        if self._executor is None:
+            result = build_surb(self._params, self._key_store, reply_path)
+        else:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, build_surb_in_worker, reply_path)
+        surbid, surbkeytuple, nym_bytes, cpu_time = result
+        self._cpu_time += cpu_time
+        return surbid, surbkeytuple, nym_bytes
+
+    @log_exceptions
+    async def build_with_surb(self, path, nym_bytes, payload):
+        if self._executor is None:
+            result = build_forward_with_surb(self._params, self._key_store, path, nym_bytes, payload)
+        else:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, build_with_surb_in_worker, path, nym_bytes, payload)
+
+        msg_bytes, cpu_time = result
+        self.__update_metrics(cpu_time)
+        return msg_bytes
+
+    def __update_metrics(self, cpu_time):
+        self._n_built += 1
+        self._cpu_time += cpu_time
+        now = time.monotonic()
+        self._recent_builds.append(now)
+        while now - self._recent_builds[0] > _RATE_WINDOW:
+            self._recent_builds.popleft()
+        metrics().increment(MetricField.FACTORY_PACKETS)
+        elapsed = now - self._recent_builds[0]
+        if elapsed > 0:
+            # builds after the first one in the window, over the time they took
+            metrics().set(MetricField.FACTORY_PACKETS_PER_SECOND, (len(self._recent_builds) - 1) / elapsed)
+        if self._cpu_time > 0:
+            metrics().set(MetricField.FACTORY_PACKETS_PER_CORE_SECOND, self._n_built / self._cpu_time)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logging.info("Packet factory stopped.")
@@ -0,0 +1,69 @@
+import math
+import secrets
+import time
+from typing import Callable, Optional
+
+
+class PathSelector:
+    """
+    Samples relay hops uniformly without replacement by a partial Fisher-Yates shuffle
+    over a persistent array of candidate relays, so a path costs O(hops) draws instead
+    of a candidate list rebuild per hop. The array is only rebuilt after peers_changed()
+    reports that the set of active peers changed.
+
+    With exclude_slowest > 0, the slowest fraction of relays by measured link latency
+    (scaled up by their loss rate) is left out, never more than keeps max_hops relays
+    available. Every remaining relay stays equally likely, so a relay's selection
+    probability does not reveal more than membership in the fast set.
+    """
+
+    def __init__(self, max_hops: int, exclude_slowest: float = 0.0,
+                 link_score: Optional[Callable[[int], Optional[float]]] = None, refresh_interval: float = 5.0):
+        self._max_hops = max_hops
+        self._exclude_slowest = exclude_slowest
+        self._link_score = link_score
+        self._refresh_interval = refresh_interval
+        self._stale = True
+        self._relays = []
+        self._relay_set = set()
+        self._refreshed = 0.0
+
+    def hops(self, active_peers, exclude, max_hops: int):
+        """Random relays for one path, none of them in exclude."""
+        self.__update(active_peers)
+        relays = self._relays
+        n_excluded = sum(1 for node in exclude if node in self._relay_set)
+        n_eligible = len(relays) - n_excluded
+        path_length = secrets.randbelow(min(max_hops, n_eligible) + 1) if n_eligible > 0 else 0
+
+        path = []
+        i = 0
+        while len(path) < path_length:
+            j = i + secrets.randbelow(len(relays) - i)
+            relays[i], relays[j] = relays[j], relays[i]
+            if relays[i] not in exclude:
+                path.append(relays[i])
+            i += 1
+        return path
+
+    def peers_changed(self):
+        self._stale = True
+
+    def __update(self, active_peers):
+        now = time.monotonic()
+        if not self._stale and (self._exclude_slowest <= 0 or now - self._refreshed < self._refresh_interval):
+            return
+        self._stale = False
+        self._refreshed = now
+        self._relays = self.__fast_relays(list(active_peers))
+        self._relay_set = set(self._relays)
+
+    def __fast_relays(self, peers):
+        if self._exclude_slowest <= 0 or self._link_score is None:
+            return peers
+        scored = [(score, peer_id) for peer_id in peers if (score := self._link_score(peer_id)) is not None]
+        n_drop = min(math.ceil(self._exclude_slowest * len(peers)), len(scored), len(peers) - self._max_hops - 2)
+        if n_drop <= 0:
+            return peers
+        slowest = {peer_id for _, peer_id in sorted(scored, reverse=True)[:n_drop]}
+        return [peer_id for peer_id in peers if peer_id not in slowest]
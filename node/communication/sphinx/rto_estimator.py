@@ -0,0 +1,62 @@
+from collections import defaultdict
+from typing import Optional
+
+from metrics.node_metrics import metrics, MetricField
+
+
+class RtoEstimator:
+    """
+    Retransmission timeouts per (target node, path length) from smoothed RTT
+    and RTT variance (RFC 6298), with exponential backoff after a timeout.
+    Every (re)transmission carries its own SURB, so samples are never
+    ambiguous; fragments that already timed out are simply not sampled.
+    The published RTO of a peer is the largest over its path lengths.
+    """
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+    MAX_BACKOFF = 64
+
+    def __init__(self, initial_rto: float, min_rto: float, max_rto: float):
+        self._initial_rto = initial_rto
+        self._min_rto = min_rto
+        self._max_rto = max_rto
+        self._srtt = {}
+        self._rttvar = {}
+        self._backoff = {}
+        self._path_lengths = defaultdict(set)  # target node -> path lengths with RTO state
+
+    def rto(self, key) -> float:
+        if key in self._srtt:
+            base = self._srtt[key] + self.K * self._rttvar[key]
+        else:
+            base = self._initial_rto
+        rto = max(self._min_rto, base) * self._backoff.get(key, 1)
+        return min(self._max_rto, rto)
+
+    def observe(self, key, rtt: float):
+        if key not in self._srtt:
+            self._srtt[key] = rtt
+            self._rttvar[key] = rtt / 2
+        else:
+            self._rttvar[key] = (1 - self.BETA) * self._rttvar[key] + self.BETA * abs(self._srtt[key] - rtt)
+            self._srtt[key] = (1 - self.ALPHA) * self._srtt[key] + self.ALPHA * rtt
+        self._backoff[key] = 1
+        self.__update_metric(key)
+
+    def node_latency(self, target_node) -> Optional[float]:
+        """Smoothed RTT per hop of the paths to target_node, None before its first sample."""
+        per_hop = [srtt / max(1, n_hops) for (node, n_hops), srtt in self._srtt.items() if node == target_node]
+        if not per_hop:
+            return None
+        return sum(per_hop) / len(per_hop)
+
+    def timed_out(self, key):
+        self._backoff[key] = min(self._backoff.get(key, 1) * 2, self.MAX_BACKOFF)
+        self.__update_metric(key)
+
+    def __update_metric(self, key):
+        target_node, n_hops = key
+        self._path_lengths[target_node].add(n_hops)
+        rto = max(self.rto((target_node, length)) for length in self._path_lengths[target_node])
+        metrics().set_labeled(MetricField.RTO, f"peer_{target_node}", rto)
@@ -1,36 +1,66 @@
 import logging
 import secrets
 
-from sphinxmix.SphinxClient import (
-    create_forward_message, PFdecode,
-    Nenc, pack_message, unpack_message,
-    create_surb, package_surb, receive_surb
-)
-from sphinxmix.SphinxNode import sphinx_process
+from sphinxmix.SphinxClient import receive_surb
 
 from communication.sphinx.cache import Cache
 from communication.sphinx.key_store import KeyStore
+from communication.sphinx.link_stats import LinkStats
+from communication.sphinx.packet_factory import PacketFactory
+from communication.sphinx.path_selector import PathSelector
+from communication.sphinx.sphinx_worker import forward_payload_capacity
+from communication.sphinx.surb_reservoir import SurbReservoir
 from metrics.node_metrics import metrics, MetricField
 from utils.config_store import ConfigStore
 from utils.exception_decorator import log_exceptions
 
 
 class SphinxRouter:
-    def __init__(self, node_id, peers, params):
+    def __init__(self, node_id, peers, params, params_kwargs):
         self._max_hops = ConfigStore.max_hops
         self._node_id = node_id
         self._params = params
         self.cache = Cache()
+        self.link_stats = LinkStats(node_id)
+        self._path_selector = PathSelector(self._max_hops, ConfigStore.path_exclude_slowest, self.__link_score)
         self._key_store = KeyStore()
         self._surb_key_store = {}
+        self._packet_factory = PacketFactory(params, params_kwargs, self._key_store,
+                                             ConfigStore.packet_factory_workers)
+        self._payload_capacity = None
+        self._surb_reservoir = None
 
     @log_exceptions
     async def router_all_acked(self):
         return await self.cache.cache_all_acked()
 
     @log_exceptions
-    def get_older_than(self, time_s: int):
-        return self.cache.get_older_than(time_s)
+    def get_expired(self):
+        return self.cache.get_expired()
+
+    @log_exceptions
+    def expire_probes(self):
+        # pooled covers are built ahead of time, so unsent probes get a long grace period
+        self.link_stats.expire(ConfigStore.resend_time, 10 * ConfigStore.resend_time)
+
+    def start_surb_reservoir(self, active_peers, idle, depth):
+        if ConfigStore.surb_reservoir_depth <= 0:
+            return
+        self._surb_reservoir = SurbReservoir(
+            self._packet_factory.build_surb,
+            lambda target, peers: self._build_path_to(target, self._node_id, peers),
+            active_peers,
+            idle,
+            depth
+        )
+        self._surb_reservoir.start()
+
+    def evict_surbs(self, peer_id):
+        if self._surb_reservoir is not None:
+            self._surb_reservoir.evict_peer(peer_id)
+
+    def peers_changed(self):
+        self._path_selector.peers_changed()
 
     @log_exceptions
     def remove_cache_for_disconnected(self, target_node):
@@ -40,50 +70,49 @@ class SphinxRouter:
             logging.info(f"Deleted {n_deleted} fragments for node {target_node}.")
 
     @log_exceptions
-    async def create_forward_msg(self, target_node, payload, active_peers, cover):
-        path, nodes_routing, keys_nodes = self.build_forward_path(target_node, active_peers)
-        _, nodes_routing_back, keys_nodes_back = self.build_surb_reply_path(target_node, active_peers)
+    async def create_forward_msg(self, target_node, payload, active_peers, cover, direct=False, first_hop=None,
+                                 group=None):
+        surb = None
+        if not cover and not direct and self._surb_reservoir is not None:
+            surb = self._surb_reservoir.take(target_node)
+
+        if direct:
+            path, reply_path = [target_node], [self._node_id]
+        else:
+            path = self._build_path_to(self._node_id, target_node, active_peers, first_hop)
+            reply_path = surb.reply_path if surb else self._build_path_to(target_node, self._node_id, active_peers)
 
-        surbid, surbkeytuple, nymtuple = self.create_and_store_surb(nodes_routing_back, keys_nodes_back)
-        header, delta = self.create_forward_packet(nodes_routing, keys_nodes, nymtuple, payload)
-        msg_bytes = pack_message(self._params, (header, delta))
+        if surb is not None:
+            # only the forward header is built now, the SURB was prepared while the network was idle
+            surbid, surbkeytuple = surb.surb_id, surb.surb_key_tuple
+            msg_bytes = await self._packet_factory.build_with_surb(path, surb.nym_bytes, payload)
+        else:
+            msg_bytes, surbid, surbkeytuple = await self._packet_factory.build(path, reply_path, payload)
 
         if not cover:
-            self.cache.new_fragment(surbid, surbkeytuple, target_node, payload, cover)
+            self.cache.new_fragment(surbid, surbkeytuple, target_node, payload, cover, len(path) + len(reply_path),
+                                    group)
             timestamp_callback = lambda surbid=surbid: self.cache.set_fragment_timestamp(surbid)
             return path, msg_bytes, timestamp_callback
+        elif ConfigStore.loop_covers and not direct:
+            self.link_stats.new_probe(surbid, path, reply_path)
+            return path, msg_bytes, lambda surbid=surbid: self.link_stats.sent(surbid)
         else:
             return path, msg_bytes, None
 
     @log_exceptions
-    def create_surb_reply(self, nymtuple):
-        reply_msg = f"Message received by node {self._node_id}".encode()
-        header, delta = package_surb(self._params, nymtuple, reply_msg)
-        msg_bytes = pack_message(self._params, (header, delta))
-        first_hop = PFdecode(self._params, nymtuple[0])[1]
-        return msg_bytes, first_hop
-
-    @log_exceptions
-    def build_forward_path(self, target_node, active_peers):
-        path = self._build_path_to(self._node_id, target_node, active_peers)
-        return path, list(map(Nenc, path)), [self._key_store.get_y(nid) for nid in path]
-
-    @log_exceptions
-    def build_surb_reply_path(self, target_node, active_peers):
-        path = self._build_path_to(target_node, self._node_id, active_peers)
-        return path, list(map(Nenc, path)), [self._key_store.get_y(nid) for nid in path]
-
-    @log_exceptions
-    def create_and_store_surb(self, routing, keys):
-        surbid, surbkeytuple, nymtuple = create_surb(self._params, routing, keys, b"myself")
-        return surbid, surbkeytuple, nymtuple
-
-    @log_exceptions
-    def create_forward_packet(self, routing, keys, nymtuple, payload):
-        return create_forward_message(self._params, routing, keys, b"peer-message", (nymtuple, payload))
+    def payload_capacity(self):
+        if self._payload_capacity is None:
+            self._payload_capacity = forward_payload_capacity(self._params, self._key_store, self._node_id)
+        return self._payload_capacity
 
     @log_exceptions
     def decrypt_surb(self, delta: bytes, surb_id):
+        probe = self.link_stats.received(surb_id)
+        if probe is not None:
+            rto_key, rtt = probe
+            self.cache.rto_estimator.observe(rto_key, rtt)
+            return None
         key = self.cache.received_surb(surb_id)
         if key is None:
             logging.debug(f"Received SURB {surb_id} not found in cache.")
@@ -92,20 +121,35 @@ class SphinxRouter:
         return msg
 
     @log_exceptions
-    def _build_path_to(self, start, target, active_peers):
-        intermediates = [nid for nid in active_peers if nid not in [start, target]]
-        hops = SphinxRouter.secure_random_path(intermediates, self._max_hops)
+    def _build_path_to(self, start, target, active_peers, first_hop=None):
+        if first_hop is not None:
+            # the path has to leave through a given link, the remaining hops stay random
+            if first_hop == target:
+                return [target]
+            hops = self._path_selector.hops(active_peers, (start, target, first_hop), self._max_hops - 1)
+            return [first_hop] + hops + [target]
+
         if (not ConfigStore.mix_enabled):
-            hops = []
-        return hops + [target]
-
-    async def process_incoming(self, data: bytes):
-        param_dict = {(self._params.max_len, self._params.m): self._params}
-        _, (header, delta) = unpack_message(param_dict, data)
-        x = self._key_store.get_x(self._node_id)
-        _, info, (header, delta), mac_key = sphinx_process(self._params, x, header, delta)
-        routing = PFdecode(self._params, info)
-        return routing, header, delta, mac_key
+            return [target]
+        return self._path_selector.hops(active_peers, (start, target), self._max_hops) + [target]
+
+    def __link_score(self, peer_id):
+        if not ConfigStore.loop_covers:
+            # without loop covers there are no link probes, fragment RTTs to the peer stand in
+            return self.cache.rto_estimator.node_latency(peer_id)
+        latency = self.link_stats.latency(peer_id)
+        if latency is None:
+            return None
+        return latency / max(1e-3, 1.0 - self.link_stats.loss(peer_id))
+
+    @property
+    def key_store(self):
+        return self._key_store
+
+    def close(self):
+        if self._surb_reservoir is not None:
+            self._surb_reservoir.stop()
+        self._packet_factory.shutdown()
 
     @staticmethod
     def secure_random_path(nodes, max_path_length):
@@ -1,17 +1,22 @@
 import asyncio
-import hashlib
 import logging
 import secrets
+import time
 from asyncio import QueueEmpty
+from collections import defaultdict, deque
+from contextlib import contextmanager
 
 from sphinxmix.SphinxClient import (
-    Relay_flag, Dest_flag, Surb_flag,
-    receive_forward, pack_message
+    Relay_flag, Dest_flag, Surb_flag
 )
-from sphinxmix.SphinxParams import SphinxParams
 
-from communication.mixing import Mixer
+from communication.duplicate_filter import DuplicateFilter
+from communication.mixing import Mixer, TrafficClass
 from communication.packages import PackageHelper, PackageType
+from communication.readiness import PeerReadiness, PeerState
+from communication.sphinx.cover_pool import CoverPool
+from communication.sphinx.fixed_base_group import create_params
+from communication.sphinx.inbound_pipeline import InboundPipeline
 from communication.sphinx.sphinx_router import SphinxRouter
 from communication.tcp_server import TcpServer
 from metrics.node_metrics import metrics, MetricField
@@ -19,30 +24,44 @@ from utils.config_store import ConfigStore
 from utils.exception_decorator import log_exceptions
 
 
+SPHINX_PARAMS = dict(
+    header_len=192,
+    body_len=1024,
+    k=16,
+    dest_len=16
+)
+
+
 class SphinxTransport:
     def __init__(self, node_id, port, peers, node_config: ConfigStore):
         self._node_id = node_id
         self._port = port
         self._peers = peers
         if ConfigStore.cache_covers:
-            self._mixer = Mixer(self.handle_cover_traffic)
+            self._mixer = Mixer(self.handle_cover_traffic, self.__is_writable)
         else:
-            self._mixer = Mixer(self.generate_and_send_cover)
+            self._mixer = Mixer(self.generate_and_send_cover, self.__is_writable)
         self._node_config = node_config
         self.n_fragments_per_model = None  # will be set dynamically once number is determined
 
-        self._params = SphinxParams(
-            header_len=192,
-            body_len=1024,
-            k=16,
-            dest_len=16
-        )
+        self._params = create_params(SPHINX_PARAMS)
         self._packet_size = 1253
 
         self.sphinx_router = SphinxRouter(
             node_id,
             peers,
             self._params,
+            SPHINX_PARAMS
+        )
+
+        self._inbound = InboundPipeline(
+            node_id,
+            self._params,
+            SPHINX_PARAMS,
+            self.sphinx_router.key_store,
+            handler=self.__handle_processed,
+            n_workers=ConfigStore.inbound_workers,
+            batch_size=ConfigStore.inbound_batch_size
         )
 
         self._peer = TcpServer(
@@ -50,13 +69,25 @@ class SphinxTransport:
             port=port,
             peers=peers,
             packet_size=self._packet_size,
-            message_handler=self.__handle_incoming
+            message_handler=self.__handle_incoming,
+            batch_handler=self.__handle_incoming_batch,
+            on_peer_state=self.__on_peer_state
         )
 
         self._incoming_queue = asyncio.Queue()
-        self._seen_hashes = set()
+        self._duplicate_filter = DuplicateFilter(ConfigStore.dedup_capacity, ConfigStore.dedup_fp_rate)
+        self._parked = defaultdict(list)
+        self._down_since = {}
+        self._readiness = PeerReadiness(self.__expected_peers())
+        self._state = None
+        self._peers_changed = asyncio.Event()
+        self._broadcasting = False
+        self._broadcast_fragments = 0
+        self._fragments_per_target = 0
         asyncio.create_task(self.resend_loop())
-        self._cover_stash = []
+        self._cover_pool = CoverPool(self.generate_cover_traffic, self._peer.active_peers,
+                                     ConfigStore.max_cover_cache, per_link=ConfigStore.mix_lanes,
+                                     writable=self.__is_writable)
 
     @log_exceptions
     async def received_all_expected_fragments(self):
@@ -73,12 +104,20 @@ class SphinxTransport:
     async def transport_all_acked(self):
         return await self.sphinx_router.router_all_acked()
 
+    def model_chunk_size(self):
+        header_size = PackageHelper.CODED_HEADER_SIZE if ConfigStore.fec_enabled else PackageHelper.MODEL_HEADER_SIZE
+        capacity = self.sphinx_router.payload_capacity() - header_size
+        return capacity - capacity % PackageHelper.FLOAT_DTYPE.itemsize
+
     def active_nodes(self):
         return len(self._peer.active_peers())
 
     async def close_all_connections(self):
         await self._mixer.stop()
+        self._cover_pool.stop()
         await self._peer.close_all_connections()
+        self._inbound.shutdown()
+        self.sphinx_router.close()
 
     def get_all_fragments(self):
         fragments = []
@@ -93,28 +132,125 @@ class SphinxTransport:
         self._incoming_queue.put_nowait(fragment)
         logging.warning("Received unexpected fragment, pushing back to queue.")
 
+    def __expected_peers(self):
+        # join nodes start late, so the others do not wait for them
+        expected = set(self._peers) - {self._node_id}
+        if self._node_id not in self._node_config.join_nodes:
+            expected -= set(self._node_config.join_nodes)
+        return expected
+
     @log_exceptions
     async def start(self):
-        asyncio.create_task(self._peer.start())
-        await asyncio.sleep(5)
+        started = time.monotonic()
+        deadline = started + ConfigStore.startup_timeout
+        self._inbound.start()
+        await self.__wait_listening(asyncio.create_task(self._peer.start()), deadline - time.monotonic())
+        await self.__announce(PeerState.LISTENING)
+        metrics().set(MetricField.STARTUP_LISTENING_TIME, time.monotonic() - started)
+
         await self._peer.connect_peers()
+        await self.__wait_connected(self._readiness.quorum(ConfigStore.startup_quorum), deadline - time.monotonic())
+        await self.__announce(PeerState.CONNECTED)
+        metrics().set(MetricField.STARTUP_CONNECTED_TIME, time.monotonic() - started)
+
         if ConfigStore.cache_covers:
-            asyncio.create_task(self._generate_cover_traffic_loop())
-        await asyncio.sleep(5)
+            self._cover_pool.start()
+        self.sphinx_router.start_surb_reservoir(self._peer.active_peers, self.__is_idle, self.__surb_reservoir_depth)
         await self._mixer.start()
-        await asyncio.sleep(10)
+        await self.__announce(PeerState.MIXER_READY)
+        await self._readiness.wait_for(PeerState.MIXER_READY, ConfigStore.startup_quorum,
+                                       max(0.0, deadline - time.monotonic()))
+        metrics().set(MetricField.STARTUP_READY_TIME, time.monotonic() - started)
+        logging.info(f"Startup finished after {time.monotonic() - started:.2f}s.")
 
     @log_exceptions
-    async def send_to_peers(self, message):
+    async def finish(self):
+        """Announces that this node is done and waits for the quorum of peers to finish as well."""
+        await self.__announce(PeerState.DONE)
+        await self._readiness.wait_for(PeerState.DONE, ConfigStore.startup_quorum, ConfigStore.shutdown_timeout)
+
+    async def __wait_listening(self, server, timeout):
+        listening = asyncio.create_task(self._peer.listening.wait())
+        await asyncio.wait((server, listening), timeout=max(0.0, timeout), return_when=asyncio.FIRST_COMPLETED)
+        if listening.done():
+            return
+        listening.cancel()
+        if server.done():
+            server.result()  # raises the error the server failed with
+        raise TimeoutError(f"TCP server did not start listening within {ConfigStore.startup_timeout}s.")
+
+    async def __wait_connected(self, n_required, timeout):
+        async def connected():
+            while len(self._readiness.expected_peers.intersection(self._peer.active_peers())) < n_required:
+                self._peers_changed.clear()
+                await self._peers_changed.wait()
+
+        try:
+            await asyncio.wait_for(connected(), max(0.0, timeout))
+        except asyncio.TimeoutError:
+            logging.warning(f"Only {len(self._peer.active_peers())}/{n_required} peers connected after startup timeout.")
+
+    async def __announce(self, state: PeerState):
+        self._state = state
+        for peer_id in self._peer.active_peers():
+            await self.__announce_to(peer_id)
+
+    @log_exceptions
+    async def __announce_to(self, peer_id):
+        # readiness is not private, so announcements skip the mixer and take a direct path
+        payload = PackageHelper.serialize_msg(PackageHelper.format_ready_package(self._node_id, self._state))
+        path, msg_bytes, _ = await self.sphinx_router.create_forward_msg(peer_id, payload, [], cover=True,
+                                                                        direct=True)
+        await self._peer.send_to_peer(path[0], msg_bytes)
+
+    @contextmanager
+    def broadcasting(self):
+        """Marks a model broadcast. SURB reservoir refills wait until it is over and the mixer has drained."""
+        self._broadcasting = True
+        self._broadcast_fragments = 0
+        try:
+            yield
+        finally:
+            self._broadcasting = False
+            self._fragments_per_target = self._broadcast_fragments
+
+    def __is_idle(self):
+        return not self._broadcasting and self._mixer.queue_is_empty()
+
+    def __surb_reservoir_depth(self):
+        # one round's fragments per peer, so the next broadcast finds a prebuilt SURB for each of them
+        return max(ConfigStore.surb_reservoir_depth, self._fragments_per_target)
+
+    @log_exceptions
+    async def send_to_peers(self, message, group=None):
+        """Sends message to every active peer. Erasure-coded symbols pass their (group_id, k) as group."""
         peers = list(self._peer.active_peers())
-        for peer_id in peers:
-            path, msg_bytes, timestamp_callback = await self.generate_path(message, peer_id, cover=False)
-            update_metrics_task = self.increment_metric_task(MetricField.FRAGMENTS_SENT)
-            send_msg_task = self.create_send_message_task(path, msg_bytes, timestamp_callback)
-            await asyncio.sleep(ConfigStore.mix_mu)
-            await self._mixer.queue_item(send_msg_task, update_metrics_task)
+        payload = PackageHelper.serialize_msg(message)
+        self._broadcast_fragments += 1
+        # a window of builds is in flight, so the packet factory workers are kept busy
+        builds = deque()
+        try:
+            for peer_id in peers:
+                builds.append(asyncio.ensure_future(
+                    self.generate_path(payload, peer_id, cover=False, serialize=False, group=group)))
+                if len(builds) >= ConfigStore.packet_factory_window:
+                    await self.__queue_fragment(*await builds.popleft())
+            while builds:
+                await self.__queue_fragment(*await builds.popleft())
+        finally:
+            for build in builds:
+                build.cancel()
         return len(peers)
 
+    async def __queue_fragment(self, path, msg_bytes, timestamp_callback):
+        update_metrics_task = self.increment_metric_task(MetricField.FRAGMENTS_SENT)
+        send_msg_task = self.create_send_message_task(path, msg_bytes, timestamp_callback)
+        if not ConfigStore.mix_enabled:
+            # the mixer paces emission itself, only direct sends are spaced out here
+            await asyncio.sleep(ConfigStore.mix_mu)
+        await self._mixer.queue_item(send_msg_task, update_metrics_task, next_hop=path[0],
+                                     on_drop=timestamp_callback)
+
     def create_send_message_task(self, path, msg_bytes, timestamp_callback):
         async def send_message():
             await self.send(path, msg_bytes, timestamp_callback)
@@ -127,13 +263,15 @@ class SphinxTransport:
 
         return update_metrics
 
-    async def generate_path(self, message, target_node: int, cover: bool, serialize: bool = True):
-        peers = list(self._peer.active_peers())
+    async def generate_path(self, message, target_node: int, cover: bool, serialize: bool = True, first_hop=None,
+                            group=None):
+        peers = self._peer.active_peers()
         payload = message
         if serialize:
             payload = PackageHelper.serialize_msg(message)
         path, msg_bytes, timestamp_callback = await self.sphinx_router.create_forward_msg(target_node, payload, peers,
-                                                                                          cover)
+                                                                                          cover, first_hop=first_hop,
+                                                                                          group=group)
         return path, msg_bytes, timestamp_callback
 
     async def generate_path_and_send(self, message, target_node: int, cover: bool, serialize: bool = True):
@@ -152,89 +290,135 @@ class SphinxTransport:
 
     async def resend_loop(self):
         while True:
-            stale = self.sphinx_router.get_older_than(ConfigStore.resend_time)
+            stale = self.sphinx_router.get_expired()
+            self.sphinx_router.expire_probes()
             for fragment in stale:
                 if not self._peer.is_active(fragment.target_node):
-                    self.sphinx_router.remove_cache_for_disconnected(fragment.target_node)
+                    # keep fragments of a peer that is down until it reconnects or its grace period ends
+                    self._parked[fragment.target_node].append(fragment)
+                    self._down_since.setdefault(fragment.target_node, time.monotonic())
                 else:
-                    path, msg_bytes, timestamp_callback = await self.generate_path(fragment.payload,
-                                                                                   fragment.target_node,
-                                                                                   serialize=False,
-                                                                                   cover=fragment.cover)
-                    send_message_task = self.create_send_message_task(path, msg_bytes, timestamp_callback)
-                    update_metrics_task = self.increment_metric_task(MetricField.RESENT)
-                    await self._mixer.queue_item(send_message_task, update_metrics_task)
+                    await self.__resend(fragment)
             if stale:
                 logging.warning(f"Resent {len(stale)} unacked fragments.")
-            await asyncio.sleep(5)
+            self.__drop_expired_parked()
+            await asyncio.sleep(ConfigStore.resend_poll_interval)
+
+    async def __resend(self, fragment):
+        path, msg_bytes, timestamp_callback = await self.generate_path(fragment.payload,
+                                                                       fragment.target_node,
+                                                                       serialize=False,
+                                                                       cover=fragment.cover,
+                                                                       group=fragment.group)
+        send_message_task = self.create_send_message_task(path, msg_bytes, timestamp_callback)
+        update_metrics_task = self.increment_metric_task(MetricField.RESENT)
+        await self._mixer.queue_item(send_message_task, update_metrics_task, next_hop=path[0],
+                                     traffic_class=TrafficClass.RESEND, on_drop=timestamp_callback)
+
+    async def __resend_parked(self, peer_id):
+        fragments = self._parked.pop(peer_id, [])
+        for fragment in fragments:
+            await self.__resend(fragment)
+        if fragments:
+            logging.info(f"Resent {len(fragments)} parked fragments to reconnected peer {peer_id}.")
+
+    def __drop_expired_parked(self):
+        now = time.monotonic()
+        for peer_id, since in list(self._down_since.items()):
+            if now - since < ConfigStore.peer_down_grace:
+                continue
+            del self._down_since[peer_id]
+            n_parked = len(self._parked.pop(peer_id, []))
+            metrics().increment(MetricField.DELETED_CACHE_FOR_INACTIVE, n_parked)
+            self.sphinx_router.remove_cache_for_disconnected(peer_id)
+            logging.info(f"Peer {peer_id} down for {ConfigStore.peer_down_grace}s, dropped {n_parked} parked fragments.")
+
+    def __on_peer_state(self, peer_id, up):
+        self._peers_changed.set()
+        self.sphinx_router.peers_changed()
+        if up:
+            self._mixer.add_lane(peer_id)
+            self._cover_pool.refill()
+            if self._state is not None:
+                asyncio.create_task(self.__announce_to(peer_id))
+            self._down_since.pop(peer_id, None)
+            if self._parked.get(peer_id):
+                asyncio.create_task(self.__resend_parked(peer_id))
+        else:
+            self._cover_pool.evict_peer(peer_id)
+            self.sphinx_router.evict_surbs(peer_id)
+            self._mixer.remove_lane(peer_id)
+            self._down_since.setdefault(peer_id, time.monotonic())
 
     async def __handle_payload(self, payload):
+        """Handles a payload addressed to this node and returns whether its SURB should be sent back."""
         msg = PackageHelper.deserialize_msg(payload)
-        is_cover = msg["type"] == PackageType.COVER
-
-        if not is_cover:
-
-            msg_hash = hashlib.sha256(payload).digest()
-            if msg_hash in self._seen_hashes:
-                logging.debug("Duplicate fragment dropped.")
-                metrics().increment(MetricField.RECEIVED_DUPLICATE_MSG)
-                return is_cover
+        if msg["type"] == PackageType.READY:
+            await self._readiness.update(msg["node_id"], PeerState(msg["state"]))
+            return False
 
-            self._seen_hashes.add(msg_hash)
-            metrics().increment(MetricField.FRAGMENTS_RECEIVED)
-            await self._incoming_queue.put(msg)
-            return is_cover
-
-        else:
+        if msg["type"] == PackageType.COVER:
             metrics().increment(MetricField.COVERS_RECEIVED)
+            # loop covers are answered like fragments, so both look the same on the wire
+            return ConfigStore.loop_covers
 
-        return is_cover
+        if self._duplicate_filter.seen(payload, msg["round"]):
+            # acked so the sender stops resending; a filter false positive loses the fragment (see dedup_fp_rate)
+            logging.debug("Duplicate fragment dropped.")
+            metrics().increment(MetricField.RECEIVED_DUPLICATE_MSG)
+            return True
 
-    @log_exceptions
-    async def __unpack_payload(self, payload_bytes: bytes):
-        nymtuple, payload = payload_bytes
-        is_cover = await self.__handle_payload(payload)
-        return nymtuple, is_cover
+        metrics().increment(MetricField.FRAGMENTS_RECEIVED)
+        await self._incoming_queue.put(msg)
+        return True
 
-    async def __send_surb(self, nymtuple):
-        msg_bytes, first_hop = self.sphinx_router.create_surb_reply(nymtuple)
+    async def __send_surb(self, reply):
+        msg_bytes, first_hop = reply
         await self._peer.send_to_peer(first_hop, msg_bytes)
 
     @log_exceptions
     async def __handle_incoming(self, data: bytes, peer_id: int):
         metrics().increment(MetricField.TOTAL_MBYTES_RECEIVED, len(data) / 1048576)
         metrics().increment(MetricField.TOTAL_MSG_RECEIVED)
-        try:
-            unpacked = await self.sphinx_router.process_incoming(data)
-        except Exception as e:
-            logging.warning(f"Failed to unpack incoming data: {e} from {peer_id}")
+        await self._inbound.submit(data, peer_id)
+
+    @log_exceptions
+    async def __handle_incoming_batch(self, packets, peer_id: int):
+        metrics().increment(MetricField.TOTAL_MBYTES_RECEIVED, len(packets) * self._packet_size / 1048576)
+        metrics().increment(MetricField.TOTAL_MSG_RECEIVED, len(packets))
+        await self._inbound.submit_batch(packets, peer_id)
+
+    @log_exceptions
+    async def __handle_processed(self, result, peer_id: int):
+        if isinstance(result, Exception):
+            logging.warning(f"Failed to unpack incoming data: {result} from {peer_id}")
             return
 
         try:
-            await self.__handle_routing_decision(*unpacked)
+            await self.__handle_routing_decision(*result)
         except Exception as e:
             logging.exception(f"Error handling routing decision: {e} from {peer_id}")
             return
 
     @log_exceptions
-    async def __handle_routing_decision(self, routing, header, delta, mac_key):
+    async def __handle_routing_decision(self, routing, body, reply):
         if routing[0] == Relay_flag:
-            msg = pack_message(self._params, (header, delta))
-            send_message_task = self.create_forward_task(routing[1], msg)
+            send_message_task = self.create_forward_task(routing[1], body)
             update_metrics_task = self.increment_metric_task(MetricField.FORWARDED)
-            await self._mixer.queue_item(send_message_task, update_metrics_task)
+            await self._mixer.queue_item(send_message_task, update_metrics_task, next_hop=routing[1],
+                                         traffic_class=TrafficClass.RELAY)
 
         elif routing[0] == Dest_flag:
-            _, msg = receive_forward(self._params, mac_key, delta)
-            nymtuple, is_cover = await self.__unpack_payload(msg)
-            if is_cover: return
-            send_message_task = self.create_surb_reply_task(nymtuple)
+            needs_reply = await self.__handle_payload(body)
+            if not needs_reply: return
+            send_message_task = self.create_surb_reply_task(reply)
             update_metrics_task = self.increment_metric_task(MetricField.SURB_REPLIED)
-            await self._mixer.queue_item(send_message_task, update_metrics_task)
+            await self._mixer.queue_item(send_message_task, update_metrics_task, next_hop=reply[1],
+                                         traffic_class=TrafficClass.ACK)
 
         elif routing[0] == Surb_flag:
             metrics().increment(MetricField.SURB_RECEIVED)
-            self.sphinx_router.decrypt_surb(delta, routing[2])
+            self.sphinx_router.decrypt_surb(body, routing[2])
         else:
             logging.info(f"Unexpected routing flag: {routing[0]} from {routing[1]}")
 
@@ -244,35 +428,56 @@ class SphinxTransport:
 
         return send_message
 
-    def create_surb_reply_task(self, nymtuple):
+    def create_surb_reply_task(self, reply):
         async def send_message():
-            await self.__send_surb(nymtuple)
+            await self.__send_surb(reply)
 
         return send_message
 
     @log_exceptions
-    async def generate_cover_traffic(self):
+    async def generate_cover_traffic(self, first_hop=None):
         if len(self._peer.active_peers()) == 0:
             return
         target_node = secrets.choice(self._peer.active_peers())
         content = secrets.token_bytes(ConfigStore.nr_cover_bytes)
         payload = PackageHelper.format_cover_package(content)
-        path, msg_bytes, timestamp_callback = await self.generate_path(payload, target_node, cover=True)
+        path, msg_bytes, timestamp_callback = await self.generate_path(payload, target_node, cover=True,
+                                                                       first_hop=first_hop)
         return path, msg_bytes, timestamp_callback
 
-    async def generate_and_send_cover(self):
-        path, msg_bytes, timestamp_callback = await self.generate_cover_traffic()
-        return self.create_send_message_task(path, msg_bytes, timestamp_callback)
-
-    async def _generate_cover_traffic_loop(self):
-        while True:
-            if len(self._cover_stash) < ConfigStore.max_cover_cache and len(self._peer.active_peers()) != 0:
-                cover = await self.generate_and_send_cover()
-                self._cover_stash.append(cover)
-            await asyncio.sleep(ConfigStore.mix_mu)
-
-    async def handle_cover_traffic(self):
-        if len(self._cover_stash) > 0:
-            return self._cover_stash.pop()
-        else:
-            return await self.generate_and_send_cover()
+    async def generate_and_send_cover(self, first_hop=None):
+        first_hop = self.__cover_first_hop(first_hop)
+        if first_hop is not None and not self.__is_writable(first_hop):
+            # a lane whose own link is backpressured has nothing to write to
+            return None
+        cover = await self.generate_cover_traffic(first_hop)
+        if cover is None:
+            return None
+        return self.__cover_send_task(cover)
+
+    def __cover_first_hop(self, first_hop):
+        if first_hop is not None:
+            return first_hop
+        active_peers = self._peer.active_peers()
+        writable = [peer_id for peer_id in active_peers if self.__is_writable(peer_id)]
+        if not writable or len(writable) == len(active_peers):
+            return None
+        # some links are backpressured, so the cover leaves through one that takes it now
+        return secrets.choice(writable)
+
+    async def handle_cover_traffic(self, first_hop=None):
+        cover = self._cover_pool.take(first_hop)
+        if cover is None:
+            return await self.generate_and_send_cover(first_hop)
+        return self.__cover_send_task(cover)
+
+    def __cover_send_task(self, cover):
+        """Returns (first hop, send task) of a cover."""
+        path, msg_bytes, timestamp_callback = cover
+        if not self.__is_writable(path[0]):
+            # a cover must not stall the mixer behind a backpressured link
+            return None
+        return path[0], self.create_send_message_task(path, msg_bytes, timestamp_callback)
+
+    def __is_writable(self, peer_id):
+        return self._peer.is_writable(peer_id)
@@ -0,0 +1,118 @@
+import os
+import time
+
+from petlib.pack import encode, decode
+from sphinxmix.SphinxClient import (
+    Relay_flag, Dest_flag,
+    create_forward_message, create_surb, receive_forward,
+    PFdecode, pack_message, unpack_message, package_surb
+)
+from sphinxmix.SphinxNode import sphinx_process
+
+from communication.sphinx.fixed_base_group import create_params
+from communication.sphinx.key_store import KeyStore
+from metrics.node_metrics import init_metrics
+
+# Slack for msgpack length prefixes that grow with the payload size.
+_BODY_MARGIN = 8
+
+# Per-process state of a pool worker, initialized once by init_worker.
+_worker_params = None
+_worker_key_store = None
+
+
+def init_worker(params_kwargs):
+    global _worker_params, _worker_key_store
+    init_metrics(controller_url="", host_name=f"sphinx_worker_{os.getpid()}")
+    _worker_params = create_params(params_kwargs)
+    _worker_key_store = KeyStore()
+
+
+def build_forward_packet(params, key_store, path, reply_path, payload):
+    start = time.process_time()
+    routing, keys = key_store.path_keys(path)
+    routing_back, keys_back = key_store.path_keys(reply_path)
+
+    surbid, surbkeytuple, nymtuple = create_surb(params, routing_back, keys_back, b"myself")
+    header, delta = create_forward_message(params, routing, keys, b"peer-message", (nymtuple, payload))
+    msg_bytes = pack_message(params, (header, delta))
+    return msg_bytes, surbid, surbkeytuple, time.process_time() - start
+
+
+def build_surb(params, key_store, reply_path):
+    """
+    Creates a SURB for reply_path ahead of its forward message. The nymtuple holds EC
+    points, so it is returned petlib-encoded to cross the process boundary.
+    """
+    start = time.process_time()
+    routing_back, keys_back = key_store.path_keys(reply_path)
+    surbid, surbkeytuple, nymtuple = create_surb(params, routing_back, keys_back, b"myself")
+    return surbid, surbkeytuple, encode(nymtuple), time.process_time() - start
+
+
+def build_forward_with_surb(params, key_store, path, nym_bytes, payload):
+    start = time.process_time()
+    routing, keys = key_store.path_keys(path)
+    header, delta = create_forward_message(params, routing, keys, b"peer-message", (decode(nym_bytes), payload))
+    return pack_message(params, (header, delta)), time.process_time() - start
+
+
+def forward_payload_capacity(params, key_store, node_id):
+    """
+    Largest payload that fits into the Sphinx body of a forward message next to
+    its SURB, measured by encoding a probe SURB the same way create_forward_message does.
+    """
+    routing, keys = key_store.path_keys([node_id])
+    _, _, nymtuple = create_surb(params, routing, keys, b"myself")
+    framing = len(encode((b"peer-message", (nymtuple, b""))))
+    # create_forward_message prefixes k zero bytes and pad_body appends one marker byte
+    return params.m - params.k - 1 - framing - _BODY_MARGIN
+
+
+def process_packet(params, key_store, node_id, data):
+    """
+    Runs the header processing and decryption of one received packet.
+    Returns (routing, body, reply) where body is the repacked message for relays,
+    the payload for destinations and the SURB delta for replies. For destinations,
+    reply holds the packed SURB reply and its first hop.
+    """
+    param_dict = {(params.max_len, params.m): params}
+    _, (header, delta) = unpack_message(param_dict, data)
+    x = key_store.get_x(node_id)
+    _, info, (header, delta), mac_key = sphinx_process(params, x, header, delta)
+    routing = PFdecode(params, info)
+
+    if routing[0] == Relay_flag:
+        return routing, pack_message(params, (header, delta)), None
+
+    if routing[0] == Dest_flag:
+        _, (nymtuple, payload) = receive_forward(params, mac_key, delta)
+        reply_msg = f"Message received by node {node_id}".encode()
+        reply_header, reply_delta = package_surb(params, nymtuple, reply_msg)
+        first_hop = PFdecode(params, nymtuple[0])[1]
+        return routing, payload, (pack_message(params, (reply_header, reply_delta)), first_hop)
+
+    return routing, delta, None
+
+
+def build_in_worker(path, reply_path, payload):
+    return build_forward_packet(_worker_params, _worker_key_store, path, reply_path, payload)
+
+
+def build_surb_in_worker(reply_path):
+    return build_surb(_worker_params, _worker_key_store, reply_path)
+
+
+def build_with_surb_in_worker(path, nym_bytes, payload):
+    return build_forward_with_surb(_worker_params, _worker_key_store, path, nym_bytes, payload)
+
+
+def process_batch_in_worker(node_id, batch):
+    start = time.process_time()
+    results = []
+    for data in batch:
+        try:
+            results.append(process_packet(_worker_params, _worker_key_store, node_id, data))
+        except Exception as e:
+            results.append(e)
+    return results, time.process_time() - start
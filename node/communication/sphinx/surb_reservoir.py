@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List
+
+from metrics.node_metrics import metrics, MetricField
+from utils.exception_decorator import log_exceptions
+
+
+@dataclass(slots=True)
+class ReadySurb:
+    surb_id: bytes
+    surb_key_tuple: tuple
+    nym_bytes: bytes  # petlib-encoded nymtuple
+    reply_path: list
+
+
+class SurbReservoir:
+    """
+    Ready SURBs per target node, built while the network is idle so a fragment
+    only needs its forward header on the critical path. Each SURB is handed out once;
+    SURBs whose reply path runs through a peer that went down are evicted.
+    The depth per target is read on every refill step, so it can follow the
+    number of fragments a round sends to each peer.
+    """
+
+    def __init__(self, builder: Callable[[list], Awaitable], reply_path: Callable[[int, List[int]], list],
+                 active_peers: Callable[[], List[int]], idle: Callable[[], bool], depth: Callable[[], int],
+                 idle_poll_interval: float = 0.1):
+        self._builder = builder
+        self._reply_path = reply_path
+        self._active_peers = active_peers
+        self._idle = idle
+        self._depth = depth
+        self._idle_poll_interval = idle_poll_interval
+        self._surbs = defaultdict(deque)
+        self._task = None
+        self._hits = 0
+        self._misses = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self.__refill_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def take(self, target_node: int):
+        surbs = self._surbs.get(target_node)
+        if surbs:
+            self._hits += 1
+            surb = surbs.popleft()
+        else:
+            self._misses += 1
+            surb = None
+        self.__update_metrics()
+        return surb
+
+    def evict_peer(self, peer_id: int):
+        n_evicted = len(self._surbs.pop(peer_id, ()))
+        for target_node, surbs in self._surbs.items():
+            kept = deque(surb for surb in surbs if peer_id not in surb.reply_path)
+            n_evicted += len(surbs) - len(kept)
+            self._surbs[target_node] = kept
+        if n_evicted:
+            logging.debug(f"Evicted {n_evicted} SURBs through inactive peer {peer_id}.")
+        self.__update_metrics()
+
+    def __len__(self):
+        return sum(len(surbs) for surbs in self._surbs.values())
+
+    @log_exceptions
+    async def __refill_loop(self):
+        while True:
+            active_peers = self._active_peers()
+            target_node = min(active_peers, key=lambda peer_id: len(self._surbs.get(peer_id, ())), default=None)
+            if (target_node is None or len(self._surbs.get(target_node, ())) >= self._depth()
+                    or not self._idle()):
+                await asyncio.sleep(self._idle_poll_interval)
+                continue
+
+            reply_path = self._reply_path(target_node, active_peers)
+            try:
+                surb_id, surb_key_tuple, nym_bytes = await self._builder(reply_path)
+            except Exception as e:
+                logging.warning(f"Failed to build SURB for node {target_node}: {e}")
+                await asyncio.sleep(self._idle_poll_interval)
+                continue
+            if all(peer_id in self._active_peers() for peer_id in reply_path[:-1]):
+                self._surbs[target_node].append(ReadySurb(surb_id, surb_key_tuple, nym_bytes, reply_path))
+            self.__update_metrics()
+
+    def __update_metrics(self):
+        metrics().set(MetricField.SURB_RESERVOIR_DEPTH, len(self))
+        total = self._hits + self._misses
+        if total:
+            metrics().set(MetricField.SURB_RESERVOIR_HIT_RATE, self._hits / total)
@@ -1,21 +1,40 @@
 import asyncio
 import logging
+import random
 
 from communication.connection import Connection
 from metrics.node_metrics import metrics, MetricField
+from utils.config_store import ConfigStore
 from utils.exception_decorator import log_exceptions
 from utils.logging_config import log_header
 
 
 class TcpServer:
-    def __init__(self, node_id: int, port: int, peers: dict, message_handler, packet_size):
+    """
+    Listens for peer traffic and keeps a pool of outbound peer connections.
+    Peers that cannot be reached or drop are reconnected in the background with
+    exponential backoff and full jitter; up/down transitions are reported to on_peer_state.
+    """
+
+    def __init__(self, node_id: int, port: int, peers: dict, message_handler, packet_size, batch_handler=None,
+                 on_peer_state=None):
         self.node_id = node_id
         self.port = port
         self.peers = peers
         self.message_handler = message_handler
+        self.batch_handler = batch_handler
+        self.on_peer_state = on_peer_state
         self.packet_size = packet_size
         self._server = None
         self.connections = {}
+        self._active_peers = []
+        self._active_version = None
+        self.peers_version = 0  # bumped on every peer up/down transition
+        self._peer_up = {}
+        self._connect_locks = {}
+        self._reconnect_tasks = {}
+        self._closing = False
+        self.listening = asyncio.Event()
 
     @log_exceptions
     async def start(self):
@@ -26,6 +45,7 @@ class TcpServer:
             self.port
         )
         logging.info(f"TCP server listening on port {self.port}")
+        self.listening.set()
         async with self._server:
             await self._server.serve_forever()
 
@@ -35,23 +55,39 @@ class TcpServer:
             await self.add_peer(pid)
 
     def is_active(self, peer_id):
-        return self.connections.get(peer_id).is_active
+        connection = self.connections.get(peer_id)
+        return connection is not None and connection.is_active
+
+    def is_writable(self, peer_id):
+        """Whether a send to peer_id goes through without waiting for its send buffer to drain."""
+        connection = self.connections.get(peer_id)
+        return connection is None or connection.writable
 
     def active_peers(self):
-        active_peers = [peer_id for peer_id in self.connections if self.is_active(peer_id)]
-        metrics().set(MetricField.ACTIVE_PEERS, len(active_peers))
-        return active_peers
+        """Active peer ids, rebuilt only after a peer went up or down. Callers must not modify the list."""
+        if self._active_version != self.peers_version:
+            self._active_peers = [peer_id for peer_id in self.connections if self.is_active(peer_id)]
+            self._active_version = self.peers_version
+            metrics().set(MetricField.ACTIVE_PEERS, len(self._active_peers))
+        return self._active_peers
 
     async def send_to_peer(self, peer_id, message: bytes):
         if not self.is_active(peer_id):
             logging.debug(f"Cannot send message to peer {peer_id}: not connected or inactive.")
             return
         try:
-            await asyncio.wait_for(self.connections[peer_id].send(message), timeout=0.1)
-        except (ConnectionResetError, BrokenPipeError, OSError, asyncio.TimeoutError) as e:
+            await asyncio.wait_for(self.connections[peer_id].send(message), timeout=ConfigStore.send_stall_timeout)
+        except asyncio.TimeoutError:
+            await self.connections[peer_id].close()
+            logging.warning(f"Peer {peer_id} did not drain its send buffer for {ConfigStore.send_stall_timeout}s.")
+        except (ConnectionResetError, BrokenPipeError, OSError) as e:
             await self.connections[peer_id].close()
             logging.warning(f"Send failed to peer {peer_id}: {e}")
 
+    def buffered_bytes(self, peer_id):
+        connection = self.connections.get(peer_id)
+        return connection.buffered_bytes if connection else 0
+
     def __ip_to_id(self, ip: str):
         try:
             return int(ip.split('.')[-1]) - 1
@@ -65,31 +101,101 @@ class TcpServer:
         peer_id = self.__ip_to_id(ip)
         await self.add_peer(peer_id)
         try:
-            while True:
-                data = await reader.readexactly(self.packet_size)
-                await self.message_handler(data, peer_id)
+            if ConfigStore.batched_reads and self.batch_handler is not None:
+                await self._read_batched(reader, peer_id)
+            else:
+                await self._read_single(reader, peer_id)
         except asyncio.IncompleteReadError:
             logging.error(f"Incomplete read error for node {peer_id}.")
             await self.remove_peer(peer_id)
 
+    async def _read_single(self, reader: asyncio.StreamReader, peer_id):
+        while True:
+            data = await reader.readexactly(self.packet_size)
+            await self.message_handler(data, peer_id)
+
+    async def _read_batched(self, reader: asyncio.StreamReader, peer_id):
+        # pulls large reads and hands all complete packets in them to the batch handler as memoryviews
+        leftover = b""
+        while True:
+            chunk = await reader.read(ConfigStore.read_buffer_bytes)
+            if not chunk:
+                raise asyncio.IncompleteReadError(leftover, self.packet_size)
+
+            data = leftover + chunk if leftover else chunk
+            view = memoryview(data)
+            end = len(data) - len(data) % self.packet_size
+            if end:
+                packets = [view[i:i + self.packet_size] for i in range(0, end, self.packet_size)]
+                await self.batch_handler(packets, peer_id)
+            leftover = bytes(view[end:])
+
     def is_me(self, peer_id: int):
         return peer_id == self.node_id
 
     async def add_peer(self, peer_id: int):
+        if self.is_me(peer_id):
+            return
+        if not await self.__connect(peer_id):
+            self.__schedule_reconnect(peer_id)
+
+    async def __connect(self, peer_id: int):
+        lock = self._connect_locks.setdefault(peer_id, asyncio.Lock())
+        async with lock:
+            if self.is_active(peer_id):
+                return True
+            host, port = self.peers[peer_id]
+            connection = await Connection.create(host, port, peer_id, on_closed=self.__on_connection_closed)
+            self.connections[peer_id] = connection
+            if connection.is_active:
+                self.__set_peer_state(peer_id, True)
+            return connection.is_active
+
+    def __schedule_reconnect(self, peer_id: int):
+        if self._closing or peer_id in self._reconnect_tasks:
+            return
+        self._reconnect_tasks[peer_id] = asyncio.create_task(self.__reconnect_loop(peer_id))
 
-        if (peer_id in self.connections and self.is_active(peer_id)) or self.is_me(peer_id):
+    async def __reconnect_loop(self, peer_id: int):
+        attempt = 0
+        try:
+            while not self._closing and not self.is_active(peer_id):
+                delay = min(ConfigStore.reconnect_max_delay, ConfigStore.reconnect_base_delay * 2 ** attempt)
+                await asyncio.sleep(random.uniform(0, delay))
+                attempt += 1
+                metrics().increment(MetricField.RECONNECT_ATTEMPTS)
+                await self.__connect(peer_id)
+        finally:
+            self._reconnect_tasks.pop(peer_id, None)
+
+    def __on_connection_closed(self, peer_id: int):
+        if self._closing:
             return
+        self.__set_peer_state(peer_id, False)
+        self.__schedule_reconnect(peer_id)
 
-        host, port = self.peers[peer_id]
-        self.connections[peer_id] = await Connection.create(host, port, peer_id)
+    def __set_peer_state(self, peer_id: int, up: bool):
+        if self._peer_up.get(peer_id) == up:
+            return
+        self._peer_up[peer_id] = up
+        self.peers_version += 1
+        logging.info(f"Peer {peer_id} is {'up' if up else 'down'}.")
+        metrics().increment(MetricField.PEER_UP_EVENTS if up else MetricField.PEER_DOWN_EVENTS)
+        metrics().set_labeled(MetricField.PEER_STATE, f"peer_{peer_id}", 1 if up else 0)
+        if self.on_peer_state is not None:
+            self.on_peer_state(peer_id, up)
 
     async def remove_peer(self, peer_id: int):
         if peer_id not in self.connections: return
         await self.connections[peer_id].close()
 
     async def close_all_connections(self):
+        self._closing = True
+        for task in list(self._reconnect_tasks.values()):
+            task.cancel()
         for peer_id in list(self.connections.keys()):
             await self.connections[peer_id].close()
+        self.peers_version += 1
         logging.warning("All connections closed.")
         if self._server is not None:
             self._server.close()
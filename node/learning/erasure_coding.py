@@ -0,0 +1,111 @@
+import math
+
+import numpy as np
+
+_GF_PRIMITIVE = 0x11d
+
+
+def _build_gf_tables():
+    exp = np.zeros(510, dtype=np.uint8)
+    log = np.zeros(256, dtype=np.int32)
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= _GF_PRIMITIVE
+    exp[255:] = exp[:255]
+
+    mul = exp[log[:, None] + log[None, :]]
+    mul[0, :] = 0
+    mul[:, 0] = 0
+    inv = np.zeros(256, dtype=np.uint8)
+    inv[1:] = exp[255 - log[1:]]
+    return mul, inv
+
+
+# GF(2^8) multiplication table and multiplicative inverses
+_GF_MUL, _GF_INV = _build_gf_tables()
+
+
+def _gf_matmul(a, b):
+    # (r, k) x (k, L) over GF(2^8): multiply via lookup table, add via xor
+    return np.bitwise_xor.reduce(_GF_MUL[a[:, :, None], b[None, :, :]], axis=1)
+
+
+def _gf_invert(matrix):
+    n = len(matrix)
+    aug = np.concatenate([matrix, np.eye(n, dtype=np.uint8)], axis=1)
+    for col in range(n):
+        pivots = np.nonzero(aug[col:, col])[0]
+        if pivots.size == 0:
+            raise ValueError("Singular matrix")
+        pivot = col + pivots[0]
+        if pivot != col:
+            aug[[col, pivot]] = aug[[pivot, col]]
+        aug[col] = _GF_MUL[_GF_INV[aug[col, col]], aug[col]]
+        factors = aug[:, col].copy()
+        factors[col] = 0
+        aug ^= _GF_MUL[factors[:, None], aug[col][None, :]]
+    return aug[:, n:]
+
+
+def _cauchy_rows(k, m):
+    # rows k..k+m-1 of a systematic generator, any k rows of [I; C] are invertible
+    x = np.arange(k, k + m, dtype=np.uint8)
+    y = np.arange(k, dtype=np.uint8)
+    return _GF_INV[x[:, None] ^ y[None, :]]
+
+
+class ModelErasureCoder:
+    """
+    Systematic Cauchy Reed-Solomon code over GF(2^8) applied to groups of
+    model chunks. Each group of k chunks is extended by ceil(k * redundancy)
+    parity symbols, and any k received symbols of a group recover all of its chunks.
+    """
+
+    def __init__(self, group_size: int, redundancy: float):
+        if group_size + math.ceil(group_size * redundancy) > 256:
+            raise ValueError("Group size and parity must not exceed 256 symbols")
+        self._group_size = group_size
+        self._redundancy = redundancy
+
+    def n_parity(self, group_k):
+        return math.ceil(group_k * self._redundancy)
+
+    def encode(self, chunks, symbol_len):
+        """
+        Returns (first_part, group_k, symbol_idx, symbol) for every data and parity symbol,
+        where symbol_idx < group_k are the zero-padded chunks themselves.
+        """
+        symbols = []
+        for first_part in range(0, len(chunks), self._group_size):
+            group = chunks[first_part:first_part + self._group_size]
+            group_k = len(group)
+            data = np.zeros((group_k, symbol_len), dtype=np.uint8)
+            for i, chunk in enumerate(group):
+                raw = np.frombuffer(chunk["data"], dtype=np.uint8)
+                data[i, :raw.size] = raw
+
+            parity = _gf_matmul(_cauchy_rows(group_k, self.n_parity(group_k)), data)
+            for symbol_idx, symbol in enumerate(np.concatenate([data, parity])):
+                symbols.append((first_part, group_k, symbol_idx, symbol.tobytes()))
+        return symbols
+
+    @staticmethod
+    def decode(group_k, symbols):
+        """
+        Recovers the group_k data symbols from a dict symbol_idx -> uint8 array.
+        Returns None when fewer than group_k distinct symbols were received.
+        """
+        if len(symbols) < group_k:
+            return None
+
+        indices = sorted(symbols)[:group_k]
+        received = np.stack([symbols[idx] for idx in indices])
+        if indices[-1] < group_k:
+            return received
+
+        generator = np.concatenate([np.eye(group_k, dtype=np.uint8), _cauchy_rows(group_k, indices[-1] + 1 - group_k)])
+        return _gf_matmul(_gf_invert(generator[indices]), received)
@@ -1,10 +1,14 @@
 import asyncio
 import logging
+import secrets
 import time
+from collections import defaultdict
 
-from communication.packages import PackageHelper
+from communication.packages import PackageHelper, PackageType
 from communication.sphinx.sphinx_transport import SphinxTransport
+from learning.erasure_coding import ModelErasureCoder
 from learning.model_handler import ModelHandler
+from metrics.node_metrics import metrics, MetricField
 from utils.config_store import ConfigStore
 from utils.exception_decorator import log_exceptions
 
@@ -15,25 +19,35 @@ class MessageManager:
         self._transport = transport
         self._model_handler = model_handler
         self._node_config = node_config
+        self._erasure_coder = ModelErasureCoder(ConfigStore.fec_group_size, ConfigStore.fec_redundancy)
 
     @log_exceptions
     def chunks(self):
-        chunks = self._model_handler.create_chunks()
+        chunks = self._model_handler.create_chunks(self._transport.model_chunk_size())
         n_chunks = len(chunks)
         return chunks, n_chunks
 
     @log_exceptions
     async def stream_model(self, current_round, interval):
         _, n_chunks = self.chunks()
-        for i in range(n_chunks):
-            chunks, n_chunks = self.chunks()
-            await self.send_model_chunk(current_round, i, chunks[i], n_chunks)
-            await asyncio.sleep(interval)
+        with self._transport.broadcasting():
+            for i in range(n_chunks):
+                chunks, n_chunks = self.chunks()
+                await self.send_model_chunk(current_round, i, chunks[i], n_chunks)
+                await asyncio.sleep(interval)
 
     @log_exceptions
     async def send_model_updates(self, current_round):
         chunks, n_chunks = self.chunks()
         self._transport.n_fragments_per_model = n_chunks
+        with self._transport.broadcasting():
+            if ConfigStore.fec_enabled:
+                await self.send_coded_model(current_round, chunks)
+            else:
+                await self.send_plain_model(current_round, chunks, n_chunks)
+
+    async def send_plain_model(self, current_round, chunks, n_chunks):
+        metrics().set(MetricField.PACKETS_PER_MODEL, n_chunks)
         n_peers = 0
         for i in range(n_chunks):
             n_peers = await self.send_model_chunk(current_round, i, chunks[i], n_chunks)
@@ -43,6 +57,50 @@ class MessageManager:
         msg = PackageHelper.format_model_package(current_round, chunk_idx, chunk, n_chunks)
         return await self._transport.send_to_peers(msg)
 
+    async def send_coded_model(self, current_round, chunks):
+        # random per-round tag groups the symbols of one model without naming its sender
+        model_tag = secrets.randbits(32)
+        n_floats = chunks[-1]["end"]
+        chunk_len = chunks[0]["end"] - chunks[0]["start"]
+        symbols = self._erasure_coder.encode(chunks, chunk_len * PackageHelper.FLOAT_DTYPE.itemsize)
+        metrics().set(MetricField.PACKETS_PER_MODEL, len(symbols))
+
+        n_peers = 0
+        for first_part, group_k, symbol_idx, symbol in symbols:
+            msg = PackageHelper.format_coded_package(current_round, model_tag, n_floats, chunk_len,
+                                                     first_part, group_k, symbol_idx, symbol)
+            # any group_k symbols of a group decode it, so only that many acks are awaited per peer
+            n_peers = await self._transport.send_to_peers(msg, group=((model_tag, first_part), group_k))
+        logging.info(f"Sent {len(symbols)} coded symbols for {len(chunks)} model chunks to {n_peers} peers.")
+
+    def decode_coded_models(self, coded_msgs):
+        groups = defaultdict(dict)
+        for msg in coded_msgs:
+            key = (msg["model_tag"], msg["first_part"], msg["group_k"], msg["n_floats"], msg["chunk_len"])
+            groups[key][msg["symbol_idx"]] = msg["content"]
+
+        chunks = []
+        for (_, first_part, group_k, n_floats, chunk_len), symbols in groups.items():
+            data = ModelErasureCoder.decode(group_k, symbols)
+            if data is None:
+                # fall back to the systematic symbols that did arrive
+                metrics().increment(MetricField.FEC_INCOMPLETE_GROUPS)
+                rows = {idx: symbol for idx, symbol in symbols.items() if idx < group_k}
+            else:
+                n_recovered = sum(1 for idx in range(group_k) if idx not in symbols)
+                metrics().increment(MetricField.FEC_RECOVERED_CHUNKS, n_recovered)
+                rows = dict(enumerate(data))
+
+            for idx, row in rows.items():
+                start = (first_part + idx) * chunk_len
+                end = min(start + chunk_len, n_floats)
+                chunks.append({
+                    "start": start,
+                    "end": end,
+                    "data": row.view(PackageHelper.FLOAT_DTYPE)[:end - start]
+                })
+        return chunks
+
     async def await_fragments(self, timeout: int):
         start_time = time.time()
 
@@ -64,6 +122,8 @@ class MessageManager:
         collected_parts = 0
 
         fragments = self._transport.get_all_fragments()
+        coded_msgs = [msg for msg in fragments if msg["type"] == PackageType.MODEL_CODED]
+        fragments = [msg for msg in fragments if msg["type"] != PackageType.MODEL_CODED]
 
         for msg in fragments:
             collected_parts += 1
@@ -78,6 +138,11 @@ class MessageManager:
                 buffer.append(msg["content"])
                 logging.debug(f"Received part {part_idx + 1}/{total_parts}.")
 
+        if coded_msgs:
+            decoded = self.decode_coded_models(coded_msgs)
+            collected_parts += len(decoded)
+            buffer.extend(decoded)
+
         active_nodes = self._transport.active_nodes()
         logging.info(
             f"Received total {collected_parts} parts from {active_nodes} nodes."
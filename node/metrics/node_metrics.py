@@ -45,6 +45,46 @@ class MetricField(Enum):
     QUEUED_PACKAGES = "queued_packages"
     SENDING_TIME = "sending_time"
     TOTAL_OUT_INTERVAL = "total_out_interval"
+    FACTORY_PACKETS = "factory_packets"
+    FACTORY_PACKETS_PER_SECOND = "factory_packets_per_second"
+    FACTORY_PACKETS_PER_CORE_SECOND = "factory_packets_per_core_second"
+    INBOUND_PENDING = "inbound_pending"
+    INBOUND_BATCH_SIZE = "inbound_batch_size"
+    INBOUND_PACKETS_PER_CORE_SECOND = "inbound_packets_per_core_second"
+    PACKETS_PER_MODEL = "packets_per_model"
+    FEC_RECOVERED_CHUNKS = "fec_recovered_chunks"
+    FEC_INCOMPLETE_GROUPS = "fec_incomplete_groups"
+    RTO = "rto"
+    CACHE_BYTES = "cache_bytes"
+    EWMA_RTT = "ewma_rtt"
+    MIN_RTT = "min_rtt"
+    MAX_RTT = "max_rtt"
+    P50_RTT = "p50_rtt"
+    P95_RTT = "p95_rtt"
+    P99_RTT = "p99_rtt"
+    DEDUP_BYTES = "dedup_bytes"
+    DEDUP_HIT_RATE = "dedup_hit_rate"
+    BUFFERED_BYTES = "buffered_bytes"
+    RECONNECT_ATTEMPTS = "reconnect_attempts"
+    PEER_UP_EVENTS = "peer_up_events"
+    PEER_DOWN_EVENTS = "peer_down_events"
+    PEER_STATE = "peer_state"
+    STARTUP_LISTENING_TIME = "startup_listening_time"
+    STARTUP_CONNECTED_TIME = "startup_connected_time"
+    STARTUP_READY_TIME = "startup_ready_time"
+    DELAY_SAMPLING_TIME = "delay_sampling_time"
+    MIX_RATE = "mix_rate"
+    LANE_UTILIZATION = "lane_utilization"
+    LANE_DROPPED = "lane_dropped"
+    QUEUE_LATENCY = "queue_latency"
+    COVER_POOL_SIZE = "cover_pool_size"
+    COVER_POOL_HIT_RATE = "cover_pool_hit_rate"
+    COVER_POOL_STALENESS = "cover_pool_staleness"
+    COVER_POOL_EVICTED = "cover_pool_evicted"
+    LINK_LATENCY = "link_latency"
+    LINK_LOSS = "link_loss"
+    SURB_RESERVOIR_DEPTH = "surb_reservoir_depth"
+    SURB_RESERVOIR_HIT_RATE = "surb_reservoir_hit_rate"
 
     STAGE = "stage"
     """
@@ -75,6 +115,7 @@ def metrics():
 class Metrics:
     def __init__(self, controller_url: str, host_name: str):
         self._data: Dict[MetricField, int] = {field: 0 for field in MetricField}
+        self._labeled_data: Dict[str, int | str | float] = {}
         self._data_lock = Lock()
         self._change_log: deque = deque()
         self._controller_url = controller_url
@@ -101,20 +142,29 @@ class Metrics:
         with self._data_lock:
             self._data[field] = value
 
+    def set_labeled(self, field: MetricField, label: str, value: int | str | float):
+        """Sets a per-entity value of field, reported as '<field>_<label>' (e.g. 'rto_peer_3')."""
+        with self._data_lock:
+            self._labeled_data[f"{field.value}_{label}"] = value
+
     def _flush_metrics(self):
         timestamp = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
         with self._data_lock:
+            fields = {field.value: value for field, value in self._data.items()}
+            fields.update(self._labeled_data)
             updates = [{
                 "timestamp": timestamp,
-                "field": field.value,
+                "field": field,
                 "value": value,
                 "node": self._host
-            } for field, value in self._data.items()]
+            } for field, value in fields.items()]
             self._change_log = deque(updates)
 
     def get_all(self) -> Dict[str, Any]:
         with self._data_lock:
-            return {field.value: value for field, value in self._data.items()}
+            fields = {field.value: value for field, value in self._data.items()}
+            fields.update(self._labeled_data)
+            return fields
 
     def get_log(self) -> List[Dict[str, Any]]:
         with self._data_lock:
@@ -0,0 +1,92 @@
+import math
+
+
+class QuantileSketch:
+    """
+    Mergeable log-bucketed quantile sketch (DDSketch). Quantiles are accurate to
+    relative_accuracy, memory is bounded by max_buckets by collapsing the lowest buckets.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048, min_value: float = 1e-6):
+        self._relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._max_buckets = max_buckets
+        self._min_value = min_value
+        self._buckets = {}
+        self._zero_count = 0
+        self.count = 0
+
+    def add(self, value: float):
+        self.count += 1
+        if value <= self._min_value:
+            self._zero_count += 1
+            return
+        idx = math.ceil(math.log(value) / self._log_gamma)
+        self._buckets[idx] = self._buckets.get(idx, 0) + 1
+        if len(self._buckets) > self._max_buckets:
+            self.__collapse()
+
+    def __collapse(self):
+        lowest = sorted(self._buckets)[:len(self._buckets) - self._max_buckets + 1]
+        target = lowest.pop()
+        for idx in lowest:
+            self._buckets[target] += self._buckets.pop(idx)
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self._zero_count
+        if rank < seen:
+            return 0.0
+        for idx in sorted(self._buckets):
+            seen += self._buckets[idx]
+            if seen > rank:
+                return 2 * self._gamma ** idx / (self._gamma + 1)
+        return 2 * self._gamma ** max(self._buckets) / (self._gamma + 1)
+
+    def merge(self, other: "QuantileSketch"):
+        if other._relative_accuracy != self._relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for idx, count in other._buckets.items():
+            self._buckets[idx] = self._buckets.get(idx, 0) + count
+        self._zero_count += other._zero_count
+        self.count += other.count
+        if len(self._buckets) > self._max_buckets:
+            self.__collapse()
+
+
+class StreamingStats:
+    """Constant-memory running mean, EWMA, min/max and quantiles of a stream of samples."""
+
+    def __init__(self, ewma_alpha: float = 0.1):
+        self._ewma_alpha = ewma_alpha
+        self.count = 0
+        self.mean = 0.0
+        self.ewma = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = QuantileSketch()
+
+    def add(self, value: float):
+        self.count += 1
+        self.mean += (value - self.mean) / self.count
+        self.ewma = value if self.count == 1 else self._ewma_alpha * value + (1 - self._ewma_alpha) * self.ewma
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.sketch.add(value)
+
+    def quantile(self, q: float) -> float:
+        return self.sketch.quantile(q)
+
+    def merge(self, other: "StreamingStats"):
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        self.mean = (self.mean * self.count + other.mean * other.count) / total
+        self.ewma = other.ewma if self.count == 0 else self.ewma
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sketch.merge(other.sketch)
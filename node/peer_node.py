@@ -1,5 +1,3 @@
-import asyncio
-
 from communication.sphinx.sphinx_transport import SphinxTransport
 from learning.learner import Learner
 from utils.config_store import ConfigStore
@@ -19,5 +17,5 @@ class PeerNode:
     async def start(self):
         await self._transport.start()
         await self._learning.run()
+        await self._transport.finish()
         await self._transport.close_all_connections()
-        await asyncio.sleep(90)
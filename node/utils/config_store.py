@@ -1,11 +1,16 @@
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Tuple
 
 
 @dataclass
 class ConfigStore:
     max_hops: int = 2
-    resend_time: int = 60
+    # fraction of relays with the highest measured link latency left out of paths; latency comes from loop covers
+    # when loop_covers is set and from fragment RTTs per hop otherwise
+    path_exclude_slowest: float = 0.0
+    resend_time: int = 60  # initial and maximum retransmission timeout
+    rto_min: float = 1.0
+    resend_poll_interval: float = 1.0
     push_metric_interval: int = 1
     timeout_model_collection: int = 120
     batch_size: int = 64
@@ -22,7 +27,43 @@ class ConfigStore:
     mix_std: float = 0.001
     mix_shuffle: bool = True
     mix_outbox_size: int = 10
+    mix_mode: str = "stream"  # stream sends one outbox item per delay, pool flushes the whole outbox per delay
+    mix_pool_interval: float = 0.0  # mean seconds between pool flushes, 0 matches stream bandwidth
+    mix_delay_distribution: str = "truncated_normal"  # truncated_normal, exponential or lognormal
+    delay_buffer_size: int = 4096
+    mix_class_weights: Tuple[int, ...] = (8, 4, 2, 1)  # ack, relay, originated, resend slots per scheduling round
+    mix_lanes: bool = False  # one mixing lane with its own clock per next-hop peer
+    mix_adaptive: bool = False  # speed up the mixer while real packets are queued
+    mix_max_speedup: float = 4.0
+    mix_target_queue: int = 1000  # queued packets per additional baseline rate
+    mix_rate_decay: float = 0.99  # per packet decay of the speedup once the queue drains
     nr_cover_bytes: int = 100
     pause_training: bool = False
     cache_covers: bool = True
     max_cover_cache: int = 1000
+    # minimum prebuilt SURBs per target node, grown to the fragments per peer of the last round; 0 disables it
+    surb_reservoir_depth: int = 32
+    loop_covers: bool = False  # covers return as SURB replies and measure link latency and loss
+    packet_factory_workers: int = 2  # 0 builds packets inline on the event loop
+    packet_factory_window: int = 8  # packets of a broadcast built concurrently
+    inbound_workers: int = 2  # 0 processes received packets inline on the event loop
+    inbound_batch_size: int = 64
+    connect_timeout: float = 2.0
+    reconnect_base_delay: float = 0.5
+    reconnect_max_delay: float = 30.0
+    peer_down_grace: float = 120.0  # unacked fragments of a down peer are kept this long
+    batched_reads: bool = True
+    read_buffer_bytes: int = 65536
+    send_high_watermark: int = 1048576  # queued bytes per connection before senders block
+    send_low_watermark: int = 262144
+    send_batch_bytes: int = 65536
+    send_stall_timeout: float = 10.0
+    dedup_capacity: int = 200000  # fragments per duplicate filter generation
+    # a false positive drops a genuine fragment but still acks it, so the sender never resends it and the chunk is lost
+    dedup_fp_rate: float = 1e-5
+    fec_enabled: bool = False
+    fec_group_size: int = 32
+    fec_redundancy: float = 0.25  # parity symbols per data chunk
+    startup_quorum: float = 1.0  # fraction of peers that must be ready before training starts
+    startup_timeout: float = 60.0
+    shutdown_timeout: float = 90.0